@@ -0,0 +1,121 @@
+import queue
+import threading
+import traceback
+from enum import Enum
+from functools import partial
+
+##########################################################
+# Typed event bus
+# Subscribers are registered per event class and
+# publish looks them up with type(event), so dispatch
+# is one dict lookup. Each subscriber picks how its
+# events arrive:
+# immediate: called inside publish
+# buffered:  called per event by drain()
+# batched:   called once by drain() with a list
+# threaded:  called on a worker thread of its own, so
+#            a slow subscriber never blocks publish
+##########################################################
+
+class Delivery(Enum):
+    immediate = 0
+    buffered = 1
+    batched = 2
+    threaded = 3
+
+# Tells a worker to stop
+STOP = object()
+
+class Worker():
+    def __init__(self, handler):
+        self.handler = handler
+        self.queue = queue.SimpleQueue()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self):
+        while True:
+            event = self.queue.get()
+            if event is STOP:
+                return
+            # One bad event must not take the subscriber down for good
+            try:
+                self.handler(event)
+            except Exception:
+                traceback.print_exc()
+
+    def close(self, wait=True):
+        # Events already queued are still delivered
+        self.queue.put(STOP)
+        if wait:
+            self.thread.join()
+
+class EventBus():
+    def __init__(self):
+        # Event class -> callables publish hands the event to. Only classes
+        # with subscribers are keys, so an empty bus is falsy.
+        self.handlers = {}
+        # (event class, handler) -> the callable stored in handlers
+        self.subscriptions = {}
+        self.pending = []
+        self.batches = {}
+        self.workers = {}
+
+    def __bool__(self):
+        return bool(self.handlers)
+
+    def subscribe(self, kind, handler, delivery=Delivery.immediate):
+        if (kind, handler) in self.subscriptions:
+            raise ValueError("handler is already subscribed to %s" % kind.__name__)
+        if delivery is Delivery.immediate:
+            sink = handler
+        elif delivery is Delivery.buffered:
+            sink = partial(self.buffer, handler)
+        elif delivery is Delivery.batched:
+            sink = self.batches.setdefault(handler, []).append
+        else:
+            worker = self.workers.get(handler)
+            if worker is None:
+                worker = self.workers[handler] = Worker(handler)
+            sink = worker.queue.put
+        self.subscriptions[(kind, handler)] = sink
+        self.handlers.setdefault(kind, []).append(sink)
+
+    def unsubscribe(self, kind, handler):
+        sink = self.subscriptions.pop((kind, handler))
+        sinks = self.handlers[kind]
+        sinks.remove(sink)
+        if not sinks:
+            del self.handlers[kind]
+        # Stop the worker or forget the batch once no class uses the handler
+        if not any(h is handler for k, h in self.subscriptions):
+            worker = self.workers.pop(handler, None)
+            if worker is not None:
+                worker.close(wait=False)
+            events = self.batches.pop(handler, None)
+            if events:
+                handler(events)
+
+    def publish(self, event):
+        for sink in self.handlers.get(type(event), ()):
+            sink(event)
+
+    def buffer(self, handler, event):
+        self.pending.append((handler, event))
+
+    def drain(self):
+        # Delivers buffered and batched events, meant to be called once a
+        # frame. Events published by the handlers wait for the next drain.
+        pending, self.pending = (self.pending, [])
+        for handler, event in pending:
+            handler(event)
+        for handler, events in self.batches.items():
+            if events:
+                batch = events[:]
+                events.clear()
+                handler(batch)
+
+    def close(self, wait=True):
+        # Stops the worker threads after their queued events
+        for worker in self.workers.values():
+            worker.close(wait)
@@ -0,0 +1,86 @@
+from Ioutput import *
+
+#####################################################
+# Input side of the communication channel between
+# Tetris games: decoding what Ioutput.py wrote.
+#####################################################
+
+ACTIONMASK = int(Action.LEFT | Action.RIGHT | Action.ROTATELEFT
+        | Action.ROTATERIGHT | Action.SOFTDROP | Action.FASTDROP)
+
+def decodeactions(data):
+    return [Action(b & ACTIONMASK) for b in data]
+
+class StateDecoder():
+    # Rebuilds the sender's Tetris from a byte stream of keyframes and
+    # deltas. Messages may be split across feed calls in any way.
+    def __init__(self):
+        self.pending = bytearray()
+        self.tetris = None
+        self.tick = 0
+
+    def feed(self, data):
+        # Returns how many messages were applied
+        self.pending += data
+        view = memoryview(self.pending)
+        at = applied = 0
+        while len(view)-at >= HEADER.size:
+            length = HEADER.unpack_from(view, at)[0]
+            if len(view)-at < length:
+                break
+            self.apply(view[at:at+length])
+            at += length
+            applied += 1
+        view.release()
+        del self.pending[:at]
+        return applied
+
+    def apply(self, message):
+        _, kind, self.tick, flags = HEADER.unpack_from(message)
+        at = HEADER.size
+        if kind == KEYFRAME:
+            rows, cols = DIMS.unpack_from(message, at)
+            at += DIMS.size
+            self.tetris = Tetris(rows, cols)
+        elif self.tetris is None:
+            # Deltas before the first keyframe mean nothing
+            return
+        tetris = self.tetris
+
+        if flags & FPIECE:
+            ptype, rotation, row, col = PIECE.unpack_from(message, at)
+            tetris.cpiece = Piece(ptype, rotation)
+            tetris.offset = (row, col)
+            at += PIECE.size
+        if flags & FPREVIEW:
+            tetris.npiece = Piece(*PREVIEW.unpack_from(message, at))
+            at += PREVIEW.size
+        if flags & FSCORE:
+            tetris.score, tetris.lines, tetris.pieces = SCORE.unpack_from(message, at)
+            at += SCORE.size
+        if flags & FRUNNING:
+            tetris.running = bool(RUNNING.unpack_from(message, at)[0])
+            at += RUNNING.size
+        if flags & FROWS:
+            count = ROWCOUNT.unpack_from(message, at)[0]
+            at += ROWCOUNT.size
+            for _ in range(count):
+                at = self.unpackrow(message, at)
+            # Derived counters are rebuilt from the rows
+            tetris.fill = [bin(b).count("1") for b in tetris.bits]
+            tetris.cells = sum(tetris.fill)
+            tetris.updateheights(0)
+            tetris.hash = boardhash(tetris.bits)
+
+    def unpackrow(self, message, at):
+        r, mask = ROW.unpack_from(message, at)
+        at += ROW.size
+        tetris = self.tetris
+        tetris.bits[r] = mask
+        line = tetris.board[r]
+        line[:] = 0
+        cols = [j for j in range(tetris.cols) if mask >> j & 1]
+        for i, j in enumerate(cols):
+            byte = message[at + i//2]
+            line[j] = byte >> 4 if i % 2 else byte & 15
+        return at + (len(cols)+1)//2
@@ -0,0 +1,108 @@
+import struct
+import numpy as np
+
+from engine import *
+
+#####################################################
+# Output side of the communication channel between
+# Tetris games: everything that is written to a
+# connection. Iinput.py reads it back.
+#####################################################
+
+# Client -> server: one byte with the Action bitfield of the controller,
+# sent whenever it changes.
+def encodeaction(action):
+    return bytes((int(action),))
+
+#####################################################
+# Server -> client: game state as a keyframe when a
+# client connects and small deltas after that.
+#
+# Every message starts with HEADER. flags says which
+# sections follow, in the order below. A keyframe has
+# all of them and every board row, a delta only what
+# changed since the previous message. A row is its
+# index and occupancy mask, followed by the palette
+# values of its occupied cells, two per byte.
+#####################################################
+
+HEADER = struct.Struct("<HBIB")     # message length, kind, tick, flags
+DIMS = struct.Struct("<BB")         # rows, cols
+PIECE = struct.Struct("<BBbb")      # type, rotation, row, col
+PREVIEW = struct.Struct("<BB")      # type, rotation
+SCORE = struct.Struct("<III")       # score, lines, pieces
+RUNNING = struct.Struct("<B")
+ROWCOUNT = struct.Struct("<B")
+ROW = struct.Struct("<BH")          # index, mask
+
+KEYFRAME, DELTA = (1, 2)
+FDIMS, FPIECE, FPREVIEW, FSCORE, FRUNNING, FROWS = (1, 2, 4, 8, 16, 32)
+
+class StateEncoder():
+    # Encodes into one preallocated buffer and returns a memoryview of the
+    # message, which is only valid until the next encode.
+    def __init__(self, rows, cols):
+        if cols > 16:
+            raise ValueError("row masks are 16 bit")
+        self.buffer = bytearray(HEADER.size + DIMS.size + PIECE.size + PREVIEW.size
+                + SCORE.size + RUNNING.size + ROWCOUNT.size + rows*(ROW.size + (cols+1)//2))
+        self.view = memoryview(self.buffer)
+        self.reset()
+
+    def reset(self):
+        # The next message will be a keyframe
+        self.board = None
+
+    def encode(self, tick, tetris):
+        # None when nothing changed since the last message
+        keyframe = self.board is None
+        piece = (tetris.cpiece.type, tetris.cpiece.rotation) + tetris.offset
+        preview = (tetris.npiece.type, tetris.npiece.rotation)
+        score = (tetris.score, tetris.lines, tetris.pieces)
+        if keyframe:
+            flags = FDIMS | FPIECE | FPREVIEW | FSCORE | FRUNNING | FROWS
+            rows = range(tetris.rows)
+        else:
+            flags = ((piece != self.piece and FPIECE) | (preview != self.preview and FPREVIEW)
+                    | (score != self.score and FSCORE) | (tetris.running != self.running and FRUNNING))
+            rows = np.nonzero((tetris.board != self.board).any(1))[0]
+            if len(rows):
+                flags |= FROWS
+            if not flags:
+                return None
+
+        at = HEADER.size
+        if flags & FDIMS:
+            DIMS.pack_into(self.buffer, at, tetris.rows, tetris.cols)
+            at += DIMS.size
+        if flags & FPIECE:
+            PIECE.pack_into(self.buffer, at, *piece)
+            at += PIECE.size
+        if flags & FPREVIEW:
+            PREVIEW.pack_into(self.buffer, at, *preview)
+            at += PREVIEW.size
+        if flags & FSCORE:
+            SCORE.pack_into(self.buffer, at, *score)
+            at += SCORE.size
+        if flags & FRUNNING:
+            RUNNING.pack_into(self.buffer, at, tetris.running)
+            at += RUNNING.size
+        if flags & FROWS:
+            ROWCOUNT.pack_into(self.buffer, at, len(rows))
+            at += ROWCOUNT.size
+            for r in rows:
+                at = self.packrow(at, r, tetris.bits[r], tetris.board[r])
+        HEADER.pack_into(self.buffer, 0, at, KEYFRAME if keyframe else DELTA, tick, flags)
+
+        self.board = tetris.board.copy()
+        self.piece, self.preview, self.score, self.running = (piece, preview, score, tetris.running)
+        return self.view[:at]
+
+    def packrow(self, at, r, mask, line):
+        ROW.pack_into(self.buffer, at, r, mask)
+        at += ROW.size
+        colors = line[line != 0]
+        for i in range(0, len(colors), 2):
+            self.buffer[at] = colors[i] | (colors[i+1] << 4 if i+1 < len(colors) else 0)
+            at += 1
+        return at
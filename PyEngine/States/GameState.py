@@ -17,6 +17,14 @@ class GameState:
     def events(self, events):
         raise NotImplementedError
 
+    def drain(self):
+        # Once a frame, after the updates
+        pass
+
+    def leave(self):
+        # Once the state is popped, or the game quits with it on the stack
+        pass
+
     @property
     def windowsize(self):
         raise NotImplementedError
@@ -15,15 +15,26 @@ class StateStack:
     @staticmethod
     def pop() -> GameState:
         StateStack.StateChangedBeforeLastRead = True
-        return StateStack.stack.pop()
+        state = StateStack.stack.pop()
+        state.leave()
+        return state
+
+    @staticmethod
+    def clear() -> None:
+        while StateStack.stack:
+            StateStack.pop()
 
     @staticmethod
     def update(dt) -> None:
         StateStack.stack[-1].update(dt)
 
     @staticmethod
-    def render(screen) -> None:
-        StateStack.stack[-1].render(screen)
+    def drain() -> None:
+        StateStack.stack[-1].drain()
+
+    @staticmethod
+    def render(screen) -> list:
+        return StateStack.stack[-1].render(screen)
 
     @staticmethod
     def events(ev) -> None:
@@ -0,0 +1,867 @@
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import typing
+import multiprocessing
+from multiprocessing import shared_memory
+from enum import Enum
+from collections import OrderedDict
+import numpy as np
+
+from engine import *
+
+#####################################################
+# Agents
+# An agent is asked for an Action every tick.
+# Agents are pickled to the worker processes, so
+# they have to be module level classes.
+#####################################################
+
+class Agent():
+    def reset(self, tetris, seed):
+        pass
+
+    def act(self, tetris):
+        raise NotImplementedError
+
+class RandomAgent(Agent):
+    def reset(self, tetris, seed):
+        self.rng = random.Random(seed)
+
+    def act(self, tetris):
+        return Action(self.rng.randrange(64))
+
+#####################################################
+# Transposition cache
+# LRU cache of search and evaluation results keyed
+# on Tetris.hash plus whatever else the result
+# depends on, bounded by the memory its keys and
+# values hold on to.
+#####################################################
+
+class TranspositionCache():
+    # Per entry bookkeeping of the OrderedDict and the (value, size) pair
+    ENTRYOVERHEAD = 160
+
+    def __init__(self, maxbytes=64*1024*1024):
+        self.maxbytes = maxbytes
+        self.entries = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key, default=None):
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return default
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return entry[0]
+
+    def put(self, key, value):
+        old = self.entries.pop(key, None)
+        if old is not None:
+            self.bytes -= old[1]
+        size = self.ENTRYOVERHEAD + sizeof((key, value))
+        self.entries[key] = (value, size)
+        self.bytes += size
+        while self.bytes > self.maxbytes and self.entries:
+            _, (_, size) = self.entries.popitem(last=False)
+            self.bytes -= size
+            self.evictions += 1
+
+    def clear(self):
+        self.entries.clear()
+        self.bytes = 0
+
+    def stats(self):
+        return {"entries": len(self.entries), "bytes": self.bytes, "hits": self.hits,
+                "misses": self.misses, "evictions": self.evictions}
+
+def sizeof(value, seen=None):
+    # Bytes held by value and everything it contains, each object counted
+    # once. Objects that outlive any entry, enum members and the ints and
+    # constants Python caches, are free.
+    if seen is None:
+        seen = set()
+    if value is None or isinstance(value, (bool, Enum)) or id(value) in seen:
+        return 0
+    if isinstance(value, int) and -5 <= value <= 256:
+        return 0
+    seen.add(id(value))
+    size = sys.getsizeof(value)
+    if isinstance(value, (tuple, list)):
+        size += sum(sizeof(v, seen) for v in value)
+    elif isinstance(value, dict):
+        size += sum(sizeof(k, seen) + sizeof(v, seen) for k, v in value.items())
+    elif hasattr(value, "__slots__"):
+        size += sum(sizeof(getattr(value, k, None), seen) for k in value.__slots__)
+    return size
+
+#####################################################
+# Placements
+# Every final position a piece can hard drop into:
+# rotate at its current offset, slide sideways and
+# drop. Boards are then scored in one vectorized pass.
+#####################################################
+
+class Placement(typing.NamedTuple):
+    type: int
+    rotation: int
+    row: int
+    col: int
+    inputs: tuple
+
+FEATURES = ("height", "lines", "holes", "bumpiness", "wells")
+
+WEIGHTS = np.array([-0.510066, 0.760666, -0.35663, -0.184483, -0.05])
+
+def columntops(occupied):
+    # First occupied row of every column, rows when the column is empty.
+    # Works on a single board or a stack of boards.
+    rows = occupied.shape[-2]
+    return np.where(occupied.any(-2), occupied.argmax(-2), rows)
+
+def placements(tetris, piece=None, offset=None):
+    # Defaults to the falling piece, other pieces start at the spawn offset
+    if piece is None:
+        piece, offset = (tetris.cpiece, tetris.offset)
+    elif offset is None:
+        offset = (0,3)
+    shapes = ROTATIONS[piece.type]
+    top = [tetris.rows-h for h in tetris.heights]
+
+    result = []
+    # Symmetric pieces reach the same cells from several rotations
+    seen = set()
+    for turns, rotate in ((0, ()), (1, (Action.ROTATELEFT,)),
+            (2, (Action.ROTATELEFT,)*2), (3, (Action.ROTATERIGHT,))):
+        # Rotating in place, with the same kicks dorotations uses
+        rotation = (piece.rotation+turns) % 4
+        shape = shapes[rotation]
+        if turns == 2:
+            start = rotatedoffset(tetris, shapes[(piece.rotation+1) % 4], offset)
+            start = start and rotatedoffset(tetris, shape, start)
+        else:
+            start = rotatedoffset(tetris, shape, offset)
+        if start is None:
+            continue
+
+        row, col = start
+        left = col
+        while tetris.fits(shape, (row, left-1)):
+            left -= 1
+        right = col
+        while tetris.fits(shape, (row, right+1)):
+            right += 1
+
+        for c in range(left, right+1):
+            land = min(top[c+shape.left+j] - p for j, p in enumerate(shape.profile)) - 1
+            if land < row:
+                # Something hangs over the piece, drop it one row at a time
+                land = row
+                while tetris.fits(shape, (land+1, c)):
+                    land += 1
+            cells = (shape.masks, land+shape.top, c+shape.left)
+            if cells in seen:
+                continue
+            seen.add(cells)
+            move = (Action.LEFT,)*(col-c) if c < col else (Action.RIGHT,)*(c-col)
+            result.append(Placement(piece.type, rotation, land, c, rotate + move + (Action.FASTDROP,)))
+    return result
+
+def rotatedoffset(tetris, shape, offset):
+    for kick in shape.kicks:
+        candidate = (offset[0]+kick[0], offset[1]+kick[1])
+        if tetris.fits(shape, candidate):
+            return candidate
+    return None
+
+def placeboards(occupied, placements):
+    # Boolean boards after every placement and its line clears. occupied is
+    # either one board shared by all placements or one board per placement.
+    n = len(placements)
+    types, rots, rows, cols = np.array([p[:4] for p in placements], dtype=np.int64).reshape(n, 4).T
+    if occupied.ndim == 2:
+        boards = np.repeat(occupied[None], n, 0)
+    else:
+        boards = occupied.copy()
+    cells = TABLECELLS[types, rots]
+    boards[np.arange(n)[:,None], cells[:,:,0]+rows[:,None], cells[:,:,1]+cols[:,None]] = True
+
+    full = boards.all(2)
+    cleared = full.sum(1)
+    if cleared.any():
+        order = np.argsort(~full, axis=1, kind="stable")
+        boards = np.take_along_axis(boards, order[:,:,None], 1)
+        boards[np.arange(boards.shape[1]) < cleared[:,None]] = False
+    return boards, cleared
+
+def features(boards, cleared):
+    # One row of FEATURES per board
+    rows = boards.shape[1]
+    top = columntops(boards)
+    heights = rows - top
+    holes = (~boards & (np.arange(rows)[None,:,None] > top[:,None,:])).sum((1,2))
+    bumpiness = np.abs(np.diff(heights, axis=1)).sum(1)
+    # Walls count as full columns
+    walled = np.pad(heights, ((0,0),(1,1)), constant_values=rows)
+    wells = np.maximum(np.minimum(walled[:,:-2], walled[:,2:]) - heights, 0).sum(1)
+    return np.stack((heights.sum(1), cleared, holes, bumpiness, wells), 1).astype(np.float64)
+
+def evaluate(occupied, placements, weights=WEIGHTS):
+    boards, cleared = placeboards(occupied, placements)
+    return features(boards, cleared) @ weights
+
+def rankplacements(tetris, weights=WEIGHTS, piece=None, offset=None, cache=None):
+    # [(score, Placement)] best first. A cache must only be shared by
+    # callers using the same weights.
+    if piece is None:
+        piece, offset = (tetris.cpiece, tetris.offset)
+    if cache is not None:
+        key = ("rank", tetris.hash, piece.type, piece.rotation, offset)
+        ranked = cache.get(key)
+        if ranked is not None:
+            return ranked
+
+    moves = placements(tetris, piece, offset)
+    ranked = []
+    if moves:
+        scores = evaluate(tetris.board != 0, moves, weights)
+        order = np.argsort(-scores, kind="stable")
+        ranked = [(float(scores[i]), moves[i]) for i in order]
+    if cache is not None:
+        cache.put(key, ranked)
+    return ranked
+
+class PlacementAgent(Agent):
+    # Steers the falling piece to a chosen placement: rotate, then slide,
+    # then drop. choose returns the Placement for the falling piece.
+    def reset(self, tetris, seed):
+        self.target = None
+        self.piece = None
+
+    def choose(self, tetris):
+        raise NotImplementedError
+
+    def act(self, tetris):
+        if self.piece is not tetris.cpiece:
+            self.piece = tetris.cpiece
+            self.target = self.choose(tetris)
+        target = self.target
+        if target is None:
+            return Action.FASTDROP
+        if tetris.cpiece.rotation != target.rotation:
+            return target.inputs[0]
+        if tetris.offset[1] > target.col:
+            return Action.LEFT
+        if tetris.offset[1] < target.col:
+            return Action.RIGHT
+        return Action.FASTDROP
+
+class GreedyAgent(PlacementAgent):
+    def __init__(self, weights=WEIGHTS, cache=None):
+        self.weights = weights
+        self.cache = cache
+
+    def choose(self, tetris):
+        ranked = rankplacements(tetris, self.weights, cache=self.cache)
+        return ranked[0][1] if ranked else None
+
+#####################################################
+# Beam search
+# Plans over the falling piece and the preview with
+# a fixed beam width per ply. Anytime: the width is
+# doubled up to the requested one while time is left
+# and the best plan found before the deadline wins.
+# Work is only started when its cost, estimated from
+# the last pass or ply, still fits before the deadline.
+#####################################################
+
+class Node():
+    # Search state: just what placements and placeboards need. Child boards
+    # come straight out of placeboards and are kept for the next ply.
+    __slots__ = ("rows", "cols", "bits", "heights", "board", "lines", "plan")
+    fits = Tetris.fits
+
+    def __init__(self, rows, cols, bits, heights, board, lines, plan):
+        self.rows, self.cols = (rows, cols)
+        self.bits = bits
+        self.heights = heights
+        self.board = board
+        self.lines = lines
+        self.plan = plan
+
+class Plan(typing.NamedTuple):
+    score: float
+    placements: tuple
+    width: int
+    nodes: int
+    complete: bool
+
+def beamsearch(tetris, width=16, budget=None, pieces=None, weights=WEIGHTS, cache=None):
+    # budget is in seconds, None searches at full width without a deadline.
+    # Only plans that finished at full width are cached.
+    deadline = None if budget is None else time.perf_counter()+budget
+    if pieces is None:
+        pieces = (tetris.cpiece, tetris.npiece)
+    if cache is not None:
+        key = ("beam", tetris.hash, tuple((p.type, p.rotation) for p in pieces), tetris.offset, width)
+        plan = cache.get(key)
+        if plan is not None:
+            return plan
+    root = Node(tetris.rows, tetris.cols, tetris.bits, tetris.heights, tetris.board != 0, 0, ())
+
+    best = None
+    w = width if deadline is None else 1
+    while True:
+        start = time.perf_counter()
+        plan = beam(root, pieces, tetris.offset, w, weights, deadline)
+        if plan is None:
+            break
+        if best is None or plan.complete:
+            best = plan
+        if not plan.complete or w >= width:
+            break
+        # A pass at twice the width costs about twice as much
+        now = time.perf_counter()
+        if deadline is not None and now + 2*(now-start) > deadline:
+            break
+        w = min(2*w, width)
+    if cache is not None and best is not None and best.complete and best.width == width:
+        cache.put(key, best)
+    return best
+
+def beam(root, pieces, offset, width, weights, deadline):
+    # Best plan of the deepest finished ply, None if the first piece
+    # cannot be placed
+    nodes = [root]
+    best = None
+    expanded = 0
+    # Seconds per scored placement, measured on the last ply
+    rate = 0.0
+    weights = np.asarray(weights)
+    columns = 1 << np.arange(root.cols, dtype=np.int64)
+
+    for depth, piece in enumerate(pieces):
+        moves, parents = ([], [])
+        for i, node in enumerate(nodes):
+            if best is not None and deadline is not None and time.perf_counter() > deadline:
+                return best._replace(nodes=expanded, complete=False)
+            children = placements(node, piece, offset if depth == 0 else (0,3))
+            moves += children
+            parents += [i]*len(children)
+            expanded += 1
+        if not moves:
+            break
+        start = time.perf_counter()
+        if best is not None and deadline is not None and start + rate*len(moves) > deadline:
+            return best._replace(nodes=expanded, complete=False)
+
+        parents = np.array(parents)
+        boards, cleared = placeboards(np.stack([n.board for n in nodes])[parents], moves)
+        lines = np.array([n.lines for n in nodes])[parents] + cleared
+        scores = features(boards, lines) @ weights
+
+        keep = np.argsort(-scores, kind="stable")[:width]
+        bits = (boards[keep] * columns).sum(2).tolist()
+        heights = (root.rows - columntops(boards[keep])).tolist()
+        nodes = [Node(root.rows, root.cols, bits[k], heights[k], boards[i], int(lines[i]),
+                nodes[parents[i]].plan + (moves[i],)) for k, i in enumerate(keep)]
+        best = Plan(float(scores[keep[0]]), nodes[0].plan, width, expanded, True)
+        rate = (time.perf_counter()-start) / len(moves)
+
+    return best if best is None else best._replace(nodes=expanded)
+
+class BeamAgent(PlacementAgent):
+    # Default budget leaves most of a 60 FPS frame to the game and drawing.
+    # preview is how many upcoming pieces, npiece included, the agent may
+    # look at.
+    def __init__(self, width=16, budget=0.004, weights=WEIGHTS, cache=None, preview=1):
+        self.width = width
+        self.budget = budget
+        self.weights = weights
+        self.cache = cache
+        self.preview = preview
+
+    def choose(self, tetris):
+        pieces = [tetris.cpiece] + tetris.preview(self.preview)
+        plan = beamsearch(tetris, self.width, self.budget, pieces, self.weights, self.cache)
+        return plan.placements[0] if plan else None
+
+#####################################################
+# Self-play
+# Seeded headless games spread over a process pool.
+# Results are streamed back per game as they finish.
+# A hook is called with every new game before its
+# first tick and returns a callable whose result, run
+# in the worker once the game is over, comes back as
+# GameResult.extra, e.g. dataset.recordpositions.
+#####################################################
+
+class GameResult(typing.NamedTuple):
+    seed: int
+    lines: int
+    pieces: int
+    score: int
+    ticks: int
+    walltime: float
+    timedout: bool
+    extra: object = None
+
+def playgame(agent, seed, rows=20, cols=10, maxticks=None, timeout=None, randomizer=Randomizer.uniform,
+        hook=None):
+    tetris = Tetris(rows, cols, seed, randomizer)
+    agent.reset(tetris, seed)
+    finish = hook(tetris) if hook is not None else None
+
+    start = time.perf_counter()
+    ticks = 0
+    timedout = False
+    while tetris.running and (maxticks is None or ticks < maxticks):
+        tetris.act(agent.act(tetris))
+        tetris.update()
+        ticks += 1
+        # Checking the clock every tick is measurable, 256 is plenty
+        if timeout is not None and ticks % 256 == 0 and time.perf_counter()-start > timeout:
+            timedout = True
+            break
+
+    return GameResult(seed, tetris.lines, tetris.pieces, tetris.score,
+            ticks, time.perf_counter()-start, timedout, finish() if finish is not None else None)
+
+def _playgame(job):
+    return playgame(*job)
+
+def selfplay(agent, seeds, workers=None, chunksize=1, rows=20, cols=10, maxticks=None, timeout=None,
+        randomizer=Randomizer.uniform, hook=None):
+    # Yields a GameResult per seed in completion order. hook has to be
+    # picklable, e.g. a module level function.
+    jobs = [(agent, seed, rows, cols, maxticks, timeout, randomizer, hook) for seed in seeds]
+    if workers == 1:
+        yield from map(_playgame, jobs)
+        return
+    with multiprocessing.Pool(workers) as pool:
+        yield from pool.imap_unordered(_playgame, jobs, chunksize)
+
+def summarize(results):
+    results = list(results)
+    summary = {"games": len(results), "timedout": sum(r.timedout for r in results)}
+    for field in ("lines", "pieces", "score", "ticks", "walltime"):
+        values = np.array([getattr(r, field) for r in results], dtype=np.float64)
+        if not len(values):
+            continue
+        summary[field] = {
+                "mean": float(values.mean()),
+                "std": float(values.std()),
+                "min": float(values.min()),
+                "median": float(np.median(values)),
+                "max": float(values.max())}
+    return summary
+
+#####################################################
+# Weight tuning
+# Cross-entropy method over GreedyAgent weights. Every
+# candidate of a generation plays the same seeds, in
+# stages: after each stage the worse half stops, down
+# to the elite, so most games go to the candidates
+# that can still make it. The elite's mean and spread
+# give the next generation. Games run on a process
+# pool, and the state is saved after every generation
+# so a run resumes where it stopped.
+#####################################################
+
+class Candidate(typing.NamedTuple):
+    weights: list
+    # Mean lines over the games it played
+    fitness: float
+    games: int
+
+def stages(games, count=3):
+    # Cumulative games per stage, halving back from games
+    sizes = sorted({max(1, games >> k) for k in range(count)})
+    return sizes
+
+def evaluatepopulation(pool, population, seeds, elite, maxticks, rows=20, cols=10, randomizer=Randomizer.uniform):
+    # Candidates by fitness, best first. Seeds are shared by everybody.
+    lines = [[] for w in population]
+    alive = list(range(len(population)))
+    done = 0
+    for stop in stages(len(seeds)):
+        jobs = [(i, seed) for i in alive for seed in seeds[done:stop]]
+        args = [(GreedyAgent(population[i]), seed, rows, cols, maxticks, None, randomizer) for i, seed in jobs]
+        results = pool.imap(_playgame, args) if pool else map(_playgame, args)
+        for (i, seed), result in zip(jobs, results):
+            lines[i].append(result.lines)
+        done = stop
+        # The worse half stops playing, never below the elite
+        alive.sort(key=lambda i: -np.mean(lines[i]))
+        alive = alive[:max(elite, len(alive)//2)]
+    ranked = [Candidate([float(w) for w in population[i]], float(np.mean(lines[i])), len(lines[i]))
+            for i in range(len(population))]
+    # Candidates stopped early rank below all that played every seed
+    ranked.sort(key=lambda c: (c.games, c.fitness), reverse=True)
+    return ranked
+
+class Tuner():
+    def __init__(self, population=32, elite=8, games=8, maxticks=5000, seed=0, noise=0.1,
+            workers=None, checkpoint=None):
+        self.population, self.elite, self.games = (population, elite, games)
+        self.maxticks, self.seed, self.noise = (maxticks, seed, noise)
+        self.workers = workers
+        self.checkpoint = checkpoint
+        self.settings = {"population": population, "elite": elite, "games": games,
+                "maxticks": maxticks, "seed": seed, "noise": noise}
+        self.generation = 0
+        self.mean = WEIGHTS / np.linalg.norm(WEIGHTS)
+        self.std = np.full(len(FEATURES), 0.5)
+        self.rng = np.random.default_rng(seed)
+        self.best = None
+        self.history = []
+        if checkpoint and os.path.exists(checkpoint):
+            self.load()
+
+    def load(self):
+        with open(self.checkpoint) as f:
+            state = json.load(f)
+        if state["settings"] != self.settings:
+            raise ValueError("%s was written by a tuner with other settings" % self.checkpoint)
+        self.generation = state["generation"]
+        self.mean, self.std = (np.array(state["mean"]), np.array(state["std"]))
+        self.rng.bit_generator.state = state["rng"]
+        self.best = Candidate(*state["best"]) if state["best"] else None
+        self.history = state["history"]
+
+    def save(self):
+        state = {"settings": self.settings, "generation": self.generation,
+                "mean": self.mean.tolist(), "std": self.std.tolist(),
+                "rng": self.rng.bit_generator.state,
+                "best": list(self.best) if self.best else None, "history": self.history}
+        with open(self.checkpoint+".tmp", "w") as f:
+            json.dump(state, f, indent=1)
+        os.replace(self.checkpoint+".tmp", self.checkpoint)
+
+    def sample(self):
+        # Rankings only depend on the direction of the weights
+        population = self.rng.normal(self.mean, self.std, (self.population, len(self.mean)))
+        return population / np.linalg.norm(population, axis=1, keepdims=True)
+
+    def step(self, pool):
+        population = self.sample()
+        seeds = list(range(self.seed + self.generation*self.games, self.seed + (self.generation+1)*self.games))
+        ranked = evaluatepopulation(pool, population, seeds, self.elite, self.maxticks)
+        elite = np.array([c.weights for c in ranked[:self.elite]])
+        # Extra spread that fades out keeps the search from collapsing early
+        self.mean = elite.mean(0)
+        self.std = np.sqrt(elite.var(0) + self.noise/(self.generation+1))
+        if self.best is None or ranked[0].fitness > self.best.fitness:
+            self.best = ranked[0]
+        self.history.append({"generation": self.generation, "best": ranked[0].fitness,
+                "elite": float(np.mean([c.fitness for c in ranked[:self.elite]]))})
+        self.generation += 1
+        if self.checkpoint:
+            self.save()
+        return ranked
+
+    def run(self, generations, progress=None):
+        pool = multiprocessing.Pool(self.workers) if self.workers != 1 else None
+        try:
+            while self.generation < generations:
+                ranked = self.step(pool)
+                if progress:
+                    progress(self, ranked)
+        finally:
+            if pool:
+                pool.close()
+                pool.join()
+        return self.best
+
+#####################################################
+# Environment
+# Gym style reset/step over Tetris. Observations are
+# read-only views of buffers the game writes in place:
+# the palette board itself (0 empty, type+1 where
+# occupied), the falling and preview pieces and the
+# legal placement mask. The same views are returned
+# every step, copy them to keep a frame.
+#
+# Frame actions are Action flags for one tick.
+# Placement actions lock the falling piece at once,
+# numbered rotation*cols + leftmost column.
+#####################################################
+
+class ActionMode(Enum):
+    frame = 0
+    placement = 1
+
+class Observation(typing.NamedTuple):
+    # board (rows, cols) uint8, piece int16 (type, rotation, row, col) of
+    # the falling piece then (type, rotation) per preview piece, mask
+    # (4*cols) bool of the legal placement actions
+    board: np.ndarray
+    piece: np.ndarray
+    mask: np.ndarray
+
+def observationbuffers(rows, cols, preview=1, n=None):
+    # Writable buffers for one env, or n envs with a leading axis
+    lead = () if n is None else (n,)
+    return Observation(np.zeros(lead + (rows, cols), dtype=np.uint8),
+            np.zeros(lead + (4+2*preview,), dtype=np.int16),
+            np.zeros(lead + (4*cols,), dtype=bool))
+
+def readonly(array):
+    view = array.view()
+    view.flags.writeable = False
+    return view
+
+class TetrisEnv():
+    def __init__(self, rows=20, cols=10, mode=ActionMode.frame, preview=1, maxsteps=None,
+            randomizer=Randomizer.uniform, out=None):
+        # out: Observation of writable buffers to fill, see
+        # observationbuffers, e.g. slices of shared memory
+        self.rows, self.cols = (rows, cols)
+        self.mode = mode
+        self.preview = preview
+        self.maxsteps = maxsteps
+        self.randomizer = randomizer
+        self.buffers = observationbuffers(rows, cols, preview) if out is None else out
+        self.observation = Observation(*map(readonly, self.buffers))
+        self.actions = 4*cols
+        self.tetris = None
+        self.moves = {}
+
+    def reset(self, seed=None):
+        self.tetris = Tetris(self.rows, self.cols, seed, self.randomizer, self.buffers.board)
+        self.steps = 0
+        self.observe()
+        return self.observation
+
+    def step(self, action):
+        tetris = self.tetris
+        score = tetris.score
+        if self.mode is ActionMode.frame:
+            tetris.act(int(action))
+            tetris.update()
+        else:
+            tetris.apply(self.moves[int(action)], publish=True)
+            # Nothing is undone here, drop what apply saved
+            tetris.history.clear()
+        self.steps += 1
+        self.observe()
+
+        truncated = self.maxsteps is not None and self.steps >= self.maxsteps
+        done = not tetris.running or truncated
+        info = {"score": tetris.score, "lines": tetris.lines, "pieces": tetris.pieces}
+        if truncated and tetris.running:
+            info["truncated"] = True
+        return self.observation, tetris.score-score, done, info
+
+    def observe(self):
+        tetris = self.tetris
+        piece = self.buffers.piece
+        piece[:4] = (tetris.cpiece.type, tetris.cpiece.rotation) + tetris.offset
+        for i, p in enumerate(tetris.preview(self.preview)):
+            piece[4+2*i:6+2*i] = (p.type, p.rotation)
+        if self.mode is ActionMode.placement:
+            self.observemoves()
+
+    def observemoves(self):
+        # Legal placements of the falling piece, keyed by action
+        tetris = self.tetris
+        mask = self.buffers.mask
+        mask[:] = False
+        self.moves = {}
+        if not tetris.running:
+            return
+        for p in placements(tetris):
+            action = p.rotation*self.cols + p.col + ROTATIONS[p.type][p.rotation].left
+            self.moves[action] = p
+            mask[action] = True
+
+#####################################################
+# Vector environment
+# n envs stepped in worker processes. Observations,
+# actions, rewards and done flags live in one shared
+# memory block, and every worker's games draw straight
+# into it, so only commands and the final infos of
+# finished games cross the pipes. Finished envs are
+# reset at once with the next seed.
+#####################################################
+
+def sharedarrays(buffer, n, rows, cols, preview):
+    # Views of the arrays in the shared block, aligned to 8 bytes
+    layout = (("board", np.uint8, (n, rows, cols)), ("piece", np.int16, (n, 4+2*preview)),
+            ("mask", bool, (n, 4*cols)), ("action", np.int64, (n,)),
+            ("reward", np.float64, (n,)), ("done", bool, (n,)))
+    arrays = {}
+    offset = 0
+    for name, dtype, shape in layout:
+        size = int(np.prod(shape))*np.dtype(dtype).itemsize
+        if buffer is not None:
+            arrays[name] = np.ndarray(shape, dtype, buffer, offset)
+        offset += -(-size//8)*8
+    return arrays, offset
+
+def _vectorworker(pipe, name, lo, hi, n, rows, cols, mode, preview, maxsteps, randomizer):
+    memory = shared_memory.SharedMemory(name)
+    arrays, size = sharedarrays(memory.buf, n, rows, cols, preview)
+    envs = [TetrisEnv(rows, cols, mode, preview, maxsteps, randomizer,
+            Observation(arrays["board"][i], arrays["piece"][i], arrays["mask"][i]))
+            for i in range(lo, hi)]
+    seeds = {}
+    try:
+        while True:
+            command, arg = pipe.recv()
+            if command == "reset":
+                # arg: the seed of env 0, env i plays seed+i, then seed+i+n...
+                for i, env in enumerate(envs, lo):
+                    seeds[i] = arg+i
+                    env.reset(seeds[i])
+                pipe.send(None)
+            elif command == "step":
+                finished = []
+                for i, env in enumerate(envs, lo):
+                    obs, arrays["reward"][i], done, info = env.step(arrays["action"][i])
+                    arrays["done"][i] = done
+                    if done:
+                        info["seed"] = seeds[i]
+                        finished.append((i, info))
+                        seeds[i] += n
+                        env.reset(seeds[i])
+                pipe.send(finished)
+            else:
+                break
+    finally:
+        del envs, arrays
+        memory.close()
+
+class VectorEnv():
+    def __init__(self, n, workers=1, rows=20, cols=10, mode=ActionMode.frame, preview=1,
+            maxsteps=None, randomizer=Randomizer.uniform):
+        self.n = n
+        self.mode = mode
+        self.actions = 4*cols
+        size = sharedarrays(None, n, rows, cols, preview)[1]
+        self.memory = shared_memory.SharedMemory(create=True, size=size)
+        self.arrays = sharedarrays(self.memory.buf, n, rows, cols, preview)[0]
+        self.observation = Observation(*(readonly(self.arrays[k]) for k in Observation._fields))
+        self.rewards = readonly(self.arrays["reward"])
+        self.dones = readonly(self.arrays["done"])
+
+        self.pipes = []
+        self.processes = []
+        bounds = np.linspace(0, n, min(workers, n)+1).astype(int)
+        for lo, hi in zip(bounds[:-1], bounds[1:]):
+            parent, child = multiprocessing.Pipe()
+            process = multiprocessing.Process(target=_vectorworker, daemon=True,
+                    args=(child, self.memory.name, lo, hi, n, rows, cols, mode, preview,
+                    maxsteps, randomizer))
+            process.start()
+            child.close()
+            self.pipes.append(parent)
+            self.processes.append(process)
+
+    def reset(self, seed=0):
+        for pipe in self.pipes:
+            pipe.send(("reset", seed))
+        for pipe in self.pipes:
+            pipe.recv()
+        return self.observation
+
+    def step(self, actions):
+        # Returns observation, rewards, dones and the (env, info) of every
+        # game that finished, whose env already shows its next game
+        self.arrays["action"][:] = actions
+        for pipe in self.pipes:
+            pipe.send(("step", None))
+        finished = []
+        for pipe in self.pipes:
+            finished.extend(pipe.recv())
+        return self.observation, self.rewards, self.dones, finished
+
+    def close(self):
+        if self.memory is None:
+            return
+        for pipe in self.pipes:
+            pipe.send(("close", None))
+        for process in self.processes:
+            process.join()
+        # The views must go before the block can be closed
+        self.observation = self.rewards = self.dones = self.arrays = None
+        self.memory.close()
+        self.memory.unlink()
+        self.memory = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+#####################################################
+# Command line
+#####################################################
+
+AGENTS = {"random": RandomAgent, "greedy": GreedyAgent, "beam": BeamAgent}
+
+def cmdselfplay(args):
+    start = time.perf_counter()
+    results = []
+    for result in selfplay(AGENTS[args.agent](), range(args.seed, args.seed+args.games),
+            args.workers, args.chunksize, maxticks=args.maxticks, timeout=args.timeout,
+            randomizer=Randomizer[args.randomizer]):
+        results.append(result)
+    summary = summarize(results)
+    summary["elapsed"] = time.perf_counter()-start
+
+    for key, value in summary.items():
+        print(key, value)
+
+def cmdtune(args):
+    def progress(tuner, ranked):
+        print("generation %d: best %.1f lines, elite %.1f" % (tuner.generation-1,
+                ranked[0].fitness, tuner.history[-1]["elite"]))
+    tuner = Tuner(args.population, args.elite, args.games, args.maxticks, args.seed,
+            workers=args.workers, checkpoint=args.checkpoint)
+    best = tuner.run(args.generations, progress)
+    print("best %.1f lines with weights %s" % (best.fitness, ",".join("%.6f" % w for w in best.weights)))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Headless Tetris AI tools")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    sp = commands.add_parser("selfplay", help="play seeded games and summarize them")
+    sp.add_argument("--agent", choices=sorted(AGENTS), default="random")
+    sp.add_argument("--games", type=int, default=100)
+    sp.add_argument("--seed", type=int, default=0, help="seed of the first game")
+    sp.add_argument("--workers", type=int, default=None, help="default: one per core")
+    sp.add_argument("--chunksize", type=int, default=1)
+    sp.add_argument("--maxticks", type=int, default=None)
+    sp.add_argument("--timeout", type=float, default=None, help="seconds per game")
+    sp.add_argument("--randomizer", choices=[r.name for r in Randomizer], default="uniform")
+    sp.set_defaults(run=cmdselfplay)
+
+    tp = commands.add_parser("tune", help="tune GreedyAgent weights with the cross-entropy method")
+    tp.add_argument("--generations", type=int, default=20)
+    tp.add_argument("--population", type=int, default=32)
+    tp.add_argument("--elite", type=int, default=8)
+    tp.add_argument("--games", type=int, default=8, help="seeds per generation")
+    tp.add_argument("--maxticks", type=int, default=5000)
+    tp.add_argument("--seed", type=int, default=0)
+    tp.add_argument("--workers", type=int, default=None, help="default: one per core")
+    tp.add_argument("--checkpoint", help="JSON file to resume from and save to every generation")
+    tp.set_defaults(run=cmdtune)
+
+    args = parser.parse_args(argv)
+    args.run(args)
+
+if __name__ == "__main__":
+    main()
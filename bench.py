@@ -0,0 +1,296 @@
+import gc
+import sys
+import json
+import time
+import random
+import typing
+import importlib.util
+import argparse
+import platform
+import functools
+import numpy as np
+
+from engine import *
+import ai
+
+##########################################################
+# Benchmarks for the engine, AI and rendering hot paths
+# Every fixture comes from a fixed seed, so two runs
+# measure the same work. Results are per operation:
+# ops/s from the median, and percentiles over the
+# samples.
+#
+# python bench.py [names] [--time S] [--out F.json]
+#                 [--baseline F.json] [--threshold 0.1]
+##########################################################
+
+SEED = 1234
+ROWS, COLS = (20, 10)
+# A sample of a stateless benchmark runs it this long, repeated
+MINSAMPLE = 0.002
+
+class Benchmark(typing.NamedTuple):
+    name: str
+    setup: typing.Callable
+    # "render" benchmarks need pygame
+    group: str
+
+BENCHMARKS = []
+
+def benchmark(name, group="engine"):
+    # setup() returns op, timed in batches, or (prepare, op) for ops that
+    # change state, where prepare runs untimed before every single op
+    def register(setup):
+        BENCHMARKS.append(Benchmark(name, setup, group))
+        return setup
+    return register
+
+##########################################################
+# Fixtures
+##########################################################
+
+def fixture(seed=SEED, height=8):
+    # Stack built from random placements until it is height rows high
+    tetris = Tetris(ROWS, COLS, seed)
+    rng = random.Random(seed)
+    while tetris.running and max(tetris.heights) < height:
+        tetris.apply(rng.choice(ai.placements(tetris)))
+    tetris.history = []
+    return tetris
+
+def fillrows(tetris, rows):
+    # Completes rows as a blit would have, ready for clearlines
+    for r in rows:
+        tetris.bits[r] = tetris.full
+        tetris.fill[r] = tetris.cols
+        tetris.board[r][tetris.board[r] == 0] = Pieces.IPiece.value+1
+    tetris.hash = boardhash(tetris.bits)
+    tetris.cells = sum(tetris.fill)
+    tetris.updateheights(0)
+    tetris.completed = list(rows)
+
+##########################################################
+# Engine
+##########################################################
+
+@benchmark("collisionx")
+def _():
+    t = fixture()
+    return functools.partial(t.collisionx, 1, t.cpiece.shape)
+
+@benchmark("collisiony")
+def _():
+    t = fixture()
+    return functools.partial(t.collisiony, 1, t.cpiece.shape)
+
+@benchmark("collisionpiece")
+def _():
+    t = fixture()
+    # Falling piece right above the stack, so the masks are compared
+    t.offset = (ROWS-max(t.heights)-4, t.offset[1])
+    return functools.partial(t.collisionpiece, (1,0), t.cpiece.shape)
+
+@benchmark("clearlines")
+def _():
+    # Tetris under an 8 row stack
+    t = fixture()
+    fillrows(t, range(ROWS-4, ROWS))
+    snapshot = t.snapshot()
+    def prepare():
+        t.restore(snapshot)
+        t.completed = list(range(ROWS-4, ROWS))
+    return prepare, t.clearlines
+
+@benchmark("blitpiecetoboard")
+def _():
+    t = fixture()
+    placement = ai.placements(t)[0]
+    t.cpiece.rotation = placement.rotation
+    t.offset = (placement.row, placement.col)
+    snapshot = t.snapshot()
+    return functools.partial(t.restore, snapshot), t.blitpiecetoboard
+
+@benchmark("update")
+def _():
+    # Soft dropped game, restarted on game over: mostly idle ticks with a
+    # fall every 3rd and a lock and line clear now and then
+    t = Tetris(ROWS, COLS, SEED)
+    t.act(Action.SOFTDROP)
+    snapshot = t.snapshot()
+    def op():
+        t.update()
+        if not t.running:
+            t.restore(snapshot)
+    return op
+
+##########################################################
+# Whole games
+##########################################################
+
+def games(agent, maxticks):
+    seeds = iter(range(SEED, sys.maxsize))
+    return lambda: ai.playgame(agent, next(seeds), ROWS, COLS, maxticks)
+
+@benchmark("game.random", "games")
+def _():
+    return games(ai.RandomAgent(), None)
+
+@benchmark("game.greedy", "games")
+def _():
+    return games(ai.GreedyAgent(), 2000)
+
+##########################################################
+# Rendering, offscreen
+##########################################################
+
+def renderfixture():
+    import pygame
+    from tetris import SinglePlayerRenderer
+    renderer = SinglePlayerRenderer(ROWS, COLS)
+    surface = pygame.Surface(renderer.windowsize)
+    t = Tetris(ROWS, COLS, SEED)
+    t.act(Action.SOFTDROP)
+    snapshot = t.snapshot()
+    renderer.render(surface, t)
+    def advance():
+        t.update()
+        if not t.running:
+            t.restore(snapshot)
+    return renderer, surface, t, advance
+
+@benchmark("render", "render")
+def _():
+    # Dirty rect frame after one tick
+    renderer, surface, t, advance = renderfixture()
+    return advance, functools.partial(renderer.render, surface, t)
+
+@benchmark("render.full", "render")
+def _():
+    renderer, surface, t, advance = renderfixture()
+    def prepare():
+        advance()
+        renderer.view.invalidate()
+    return prepare, functools.partial(renderer.render, surface, t)
+
+##########################################################
+# Timing
+##########################################################
+
+def measure(setup, duration):
+    # Per operation times in seconds, one per sample
+    op = setup()
+    prepare = None
+    if isinstance(op, tuple):
+        prepare, op = op
+    clock = time.perf_counter
+    samples = []
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        if prepare is None:
+            # Batch size from a single call, so a sample is long enough
+            # for the clock
+            start = clock(); op(); once = clock()-start
+            number = max(1, int(MINSAMPLE/max(once, 1e-9)))
+            end = clock()+duration
+            while clock() < end or len(samples) < 5:
+                start = clock()
+                for i in range(number):
+                    op()
+                samples.append((clock()-start)/number)
+        else:
+            end = clock()+duration
+            while clock() < end or len(samples) < 5:
+                prepare()
+                start = clock()
+                op()
+                samples.append(clock()-start)
+    finally:
+        if enabled:
+            gc.enable()
+    return np.array(samples)
+
+def summarize(samples):
+    p50, p90, p99 = np.percentile(samples, (50, 90, 99))
+    return {
+            "ops": float(1/p50),
+            "mean": float(samples.mean()),
+            "min": float(samples.min()),
+            "p50": float(p50),
+            "p90": float(p90),
+            "p99": float(p99),
+            "samples": len(samples)}
+
+def run(benchmarks, duration, out=sys.stdout):
+    results = {}
+    for b in benchmarks:
+        results[b.name] = summary = summarize(measure(b.setup, duration))
+        print("%-18s %12.0f ops/s   p50 %10s   p90 %10s   p99 %10s" % (b.name, summary["ops"],
+                fmttime(summary["p50"]), fmttime(summary["p90"]), fmttime(summary["p99"])), file=out)
+    return results
+
+def fmttime(seconds):
+    for unit, scale in (("s", 1), ("ms", 1e-3), ("us", 1e-6)):
+        if seconds >= scale:
+            return "%.2f %s" % (seconds/scale, unit)
+    return "%.0f ns" % (seconds*1e9)
+
+def compare(results, baseline, threshold):
+    # Names whose median op got slower than the baseline by more than
+    # threshold, with their speed relative to it
+    regressions = []
+    for name, summary in results.items():
+        if name not in baseline:
+            continue
+        speedup = baseline[name]["p50"]/summary["p50"]
+        flag = ""
+        if speedup < 1-threshold:
+            regressions.append(name)
+            flag = "  REGRESSION"
+        print("%-18s %6.2fx%s" % (name, speedup, flag))
+    return regressions
+
+##########################################################
+# Command line
+##########################################################
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the engine, AI and renderer")
+    parser.add_argument("names", nargs="*", help="benchmarks or groups to run, default all")
+    parser.add_argument("--time", type=float, default=1.0, help="seconds per benchmark")
+    parser.add_argument("--out", help="save results as JSON")
+    parser.add_argument("--baseline", help="JSON results to compare against")
+    parser.add_argument("--threshold", type=float, default=0.1,
+            help="fail when a benchmark is this much slower than the baseline")
+    parser.add_argument("--list", action="store_true", help="list the benchmarks")
+    args = parser.parse_args(argv)
+
+    benchmarks = [b for b in BENCHMARKS if not args.names or b.name in args.names or b.group in args.names]
+    if args.list:
+        for b in benchmarks:
+            print("%-18s %s" % (b.name, b.group))
+        return 0
+    if importlib.util.find_spec("pygame") is None:
+        print("pygame is not installed, skipping the render benchmarks")
+        benchmarks = [b for b in benchmarks if b.group != "render"]
+
+    results = run(benchmarks, args.time)
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump({
+                    "python": platform.python_version(),
+                    "machine": platform.machine(),
+                    "processor": platform.processor(),
+                    "numpy": np.__version__,
+                    "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                    "results": results}, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)["results"]
+        print()
+        if compare(results, baseline, args.threshold):
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
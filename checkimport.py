@@ -0,0 +1,38 @@
+import subprocess
+import sys
+
+##########################################################
+# CI check: the headless engine has to import without
+# pygame and inside a time budget, as every worker
+# process pays this cost.
+#
+# python checkimport.py [budget in seconds]
+##########################################################
+
+BUDGET = 0.5
+
+PROBE = (
+    "import sys, time\n"
+    "start = time.perf_counter()\n"
+    "import engine\n"
+    "print(time.perf_counter() - start)\n"
+    "print('pygame' in sys.modules)\n")
+
+def main(argv):
+    budget = float(argv[1]) if len(argv) > 1 else BUDGET
+    # Fresh interpreter so nothing is cached in sys.modules
+    out = subprocess.run([sys.executable, "-c", PROBE],
+            capture_output=True, text=True, check=True).stdout.split()
+    elapsed, pygame = (float(out[0]), out[1] == "True")
+
+    print("import engine: %.1f ms (budget %.1f ms)" % (elapsed*1000, budget*1000))
+    if pygame:
+        print("engine imports pygame")
+        return 1
+    if elapsed > budget:
+        print("engine import is over budget")
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,317 @@
+import os
+import sys
+import json
+import time
+import argparse
+import numpy as np
+
+from engine import *
+from replay import *
+import ai
+
+##########################################################
+# Position datasets
+# One record per locked piece: the bitboard before the
+# lock, falling and preview piece types, the placement
+# (rotation, row, col), the score it gained and the
+# game's seed. Records go into chunks of preallocated
+# .npy memmaps, one file per field, and index.json
+# lists the chunks with their record counts. The index
+# is rewritten after every chunk, so a dataset stays
+# readable if writing stops half way.
+#
+# python dataset.py selfplay DIR [--agent greedy] ...
+# python dataset.py logs DIR game.tlog ...
+# python dataset.py info DIR
+##########################################################
+
+VERSION = 1
+CHUNKSIZE = 1 << 20
+
+def rowdtype(cols):
+    # Smallest unsigned int holding a bitboard row
+    for dtype in (np.uint8, np.uint16, np.uint32, np.uint64):
+        if cols <= 8*np.dtype(dtype).itemsize:
+            return np.dtype(dtype)
+    raise ValueError("boards wider than 64 columns are not supported")
+
+def fields(rows, cols):
+    # name -> (dtype, shape of one record)
+    return {
+            "bits": (rowdtype(cols), (rows,)),
+            "piece": (np.dtype(np.uint8), ()),
+            "next": (np.dtype(np.uint8), ()),
+            "placement": (np.dtype(np.int8), (3,)),
+            "reward": (np.dtype(np.float32), ()),
+            "seed": (np.dtype(np.uint64), ())}
+
+def unpackboards(bits, cols):
+    # (..., rows) bitboard rows to (..., rows, cols) bool boards
+    return (bits[..., None] >> np.arange(cols, dtype=bits.dtype)) & 1 == 1
+
+def chunkpath(directory, chunk, name):
+    return os.path.join(directory, "%06d.%s.npy" % (chunk, name))
+
+##########################################################
+# Recording
+##########################################################
+
+class PositionRecorder():
+    # Collects a record every time the game's falling piece locks, from
+    # its PieceLocked events, so any input works: agents, replayed human
+    # games, the env
+    def __init__(self, tetris):
+        self.tetris = tetris
+        self.columns = {name: [] for name in fields(tetris.rows, tetris.cols)}
+        self.remember()
+        tetris.events.subscribe(PieceLocked, self.locked)
+
+    def remember(self):
+        t = self.tetris
+        self.before = (list(t.bits), t.cpiece.type, t.npiece.type, t.score)
+
+    def locked(self, event):
+        bits, piece, preview, score = self.before
+        columns = self.columns
+        columns["bits"].append(bits)
+        columns["piece"].append(piece)
+        columns["next"].append(preview)
+        columns["placement"].append((event.rotation, event.row, event.col))
+        columns["reward"].append(self.tetris.score-score)
+        columns["seed"].append(self.tetris.seed)
+        self.remember()
+
+    def arrays(self):
+        t = self.tetris
+        return {name: np.array(self.columns[name], dtype=dtype).reshape((-1,)+shape)
+                for name, (dtype, shape) in fields(t.rows, t.cols).items()}
+
+def recordpositions(tetris):
+    # ai.playgame hook, workers only send back the compact arrays
+    return PositionRecorder(tetris).arrays
+
+def recordgame(agent, seed, rows=20, cols=10, maxticks=None, randomizer=Randomizer.uniform):
+    return ai.playgame(agent, seed, rows, cols, maxticks, None, randomizer, recordpositions).extra
+
+def recordgames(agent, seeds, workers=None, chunksize=1, rows=20, cols=10, maxticks=None,
+        randomizer=Randomizer.uniform):
+    # Yields the records of every game in completion order
+    for result in ai.selfplay(agent, seeds, workers, chunksize, rows, cols, maxticks, None,
+            randomizer, recordpositions):
+        yield result.extra
+
+def recordlog(log):
+    # Records of a replayed InputLog
+    replayer = Replayer(log)
+    recorder = PositionRecorder(replayer.tetris)
+    replayer.run()
+    return recorder.arrays()
+
+##########################################################
+# Writing
+##########################################################
+
+class DatasetWriter():
+    def __init__(self, directory, rows=20, cols=10, chunksize=CHUNKSIZE):
+        self.directory = directory
+        self.rows, self.cols = (rows, cols)
+        self.chunksize = chunksize
+        self.fields = fields(rows, cols)
+        os.makedirs(directory, exist_ok=True)
+        if os.path.exists(os.path.join(directory, "index.json")):
+            raise FileExistsError("%s already holds a dataset" % directory)
+        self.counts = []
+        self.chunk = None
+        self.fill = 0
+
+    def open(self):
+        # Next chunk, preallocated in full
+        self.chunk = {name: np.lib.format.open_memmap(chunkpath(self.directory, len(self.counts), name),
+                mode="w+", dtype=dtype, shape=(self.chunksize,)+shape)
+                for name, (dtype, shape) in self.fields.items()}
+        self.counts.append(0)
+        self.fill = 0
+
+    def extend(self, records):
+        # records: field -> array with one row per record, e.g. from
+        # PositionRecorder.arrays
+        n = len(records["piece"])
+        done = 0
+        while done < n:
+            if self.chunk is None or self.fill == self.chunksize:
+                self.flush()
+                self.open()
+            take = min(n-done, self.chunksize-self.fill)
+            for name, array in self.chunk.items():
+                array[self.fill:self.fill+take] = records[name][done:done+take]
+            self.fill += take
+            self.counts[-1] = self.fill
+            done += take
+        return n
+
+    def flush(self):
+        if self.chunk is None:
+            return
+        for array in self.chunk.values():
+            array.flush()
+        self.writeindex()
+
+    def writeindex(self):
+        index = {
+                "version": VERSION,
+                "rows": self.rows,
+                "cols": self.cols,
+                "chunksize": self.chunksize,
+                "fields": {name: [dtype.str, list(shape)] for name, (dtype, shape) in self.fields.items()},
+                "chunks": self.counts}
+        path = os.path.join(self.directory, "index.json")
+        with open(path+".tmp", "w") as f:
+            json.dump(index, f, indent=1)
+        os.replace(path+".tmp", path)
+
+    def close(self):
+        self.flush()
+        if self.chunk is None:
+            self.writeindex()
+        self.chunk = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+##########################################################
+# Reading
+# Chunks are opened as read-only memmaps, so only the
+# pages a batch touches are read. Shuffling is two
+# level: chunks come in random order, window chunks at
+# a time, and the records of a window are permuted
+# together. Only the window's index permutation is in
+# memory.
+##########################################################
+
+class DatasetReader():
+    def __init__(self, directory):
+        self.directory = directory
+        with open(os.path.join(directory, "index.json")) as f:
+            index = json.load(f)
+        if index["version"] != VERSION:
+            raise ValueError("unsupported dataset version %d" % index["version"])
+        self.rows, self.cols = (index["rows"], index["cols"])
+        self.fields = {name: (np.dtype(dtype), tuple(shape)) for name, (dtype, shape) in index["fields"].items()}
+        self.counts = index["chunks"]
+        self.chunks = [None]*len(self.counts)
+
+    def __len__(self):
+        return sum(self.counts)
+
+    def chunk(self, i):
+        if self.chunks[i] is None:
+            self.chunks[i] = {name: np.load(chunkpath(self.directory, i, name), mmap_mode="r")
+                    for name in self.fields}
+        return self.chunks[i]
+
+    def batches(self, batchsize, seed=None, shuffle=True, window=4, droplast=False):
+        # One epoch of batches, field -> array. Every record is yielded
+        # once, unshuffled in file order when shuffle is off.
+        rng = np.random.default_rng(seed)
+        order = [i for i in range(len(self.counts)) if self.counts[i]]
+        if shuffle:
+            rng.shuffle(order)
+        else:
+            window = 1
+        carry = None
+        for start in range(0, len(order), window):
+            group = order[start:start+window]
+            # (chunk, record) of every record in the window
+            refs = np.concatenate([np.stack((np.full(self.counts[i], i), np.arange(self.counts[i])), 1)
+                    for i in group])
+            if shuffle:
+                rng.shuffle(refs)
+            if carry is not None:
+                refs = np.concatenate((carry, refs))
+            stop = len(refs) - len(refs) % batchsize
+            for b in range(0, stop, batchsize):
+                yield self.gather(refs[b:b+batchsize])
+            carry = refs[stop:]
+        if carry is not None and len(carry) and not droplast:
+            yield self.gather(carry)
+
+    def gather(self, refs):
+        # Reads each chunk's records in file order, then puts them back
+        # in the order asked for
+        batch = {name: np.empty((len(refs),)+shape, dtype) for name, (dtype, shape) in self.fields.items()}
+        for i in np.unique(refs[:, 0]):
+            where = np.flatnonzero(refs[:, 0] == i)
+            rows = refs[where, 1]
+            order = np.argsort(rows)
+            chunk = self.chunk(i)
+            for name in self.fields:
+                batch[name][where[order]] = chunk[name][rows[order]]
+        return batch
+
+##########################################################
+# Command line
+##########################################################
+
+def cmdselfplay(args):
+    start = time.perf_counter()
+    with DatasetWriter(args.directory, chunksize=args.chunksize) as writer:
+        total = 0
+        for records in recordgames(ai.AGENTS[args.agent](), range(args.seed, args.seed+args.games),
+                args.workers, maxticks=args.maxticks, randomizer=Randomizer[args.randomizer]):
+            total += writer.extend(records)
+    print("%d positions from %d games in %.1f s" % (total, args.games, time.perf_counter()-start))
+
+def cmdlogs(args):
+    writer = None
+    total = 0
+    for path in args.logs:
+        log = InputLog.load(path)
+        if writer is None:
+            writer = DatasetWriter(args.directory, log.rows, log.cols, args.chunksize)
+        elif (log.rows, log.cols) != (writer.rows, writer.cols):
+            print("skipping %s: %dx%d board" % (path, log.rows, log.cols))
+            continue
+        total += writer.extend(recordlog(log))
+    if writer is not None:
+        writer.close()
+    print("%d positions from %d logs" % (total, len(args.logs)))
+
+def cmdinfo(args):
+    reader = DatasetReader(args.directory)
+    print("%d positions, %dx%d boards, %d chunks" % (len(reader), reader.rows, reader.cols, len(reader.counts)))
+    for name, (dtype, shape) in reader.fields.items():
+        print("  %-10s %-8s %s" % (name, dtype, shape))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Write and inspect position datasets")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    sp = commands.add_parser("selfplay", help="record positions from self-play games")
+    sp.add_argument("directory")
+    sp.add_argument("--agent", choices=sorted(ai.AGENTS), default="greedy")
+    sp.add_argument("--games", type=int, default=100)
+    sp.add_argument("--seed", type=int, default=0, help="seed of the first game")
+    sp.add_argument("--workers", type=int, default=None, help="default: one per core")
+    sp.add_argument("--maxticks", type=int, default=None)
+    sp.add_argument("--randomizer", choices=[r.name for r in Randomizer], default="uniform")
+    sp.add_argument("--chunksize", type=int, default=CHUNKSIZE, help="records per chunk")
+    sp.set_defaults(run=cmdselfplay)
+
+    lp = commands.add_parser("logs", help="record positions from input logs, see replay.py")
+    lp.add_argument("directory")
+    lp.add_argument("logs", nargs="+")
+    lp.add_argument("--chunksize", type=int, default=CHUNKSIZE, help="records per chunk")
+    lp.set_defaults(run=cmdlogs)
+
+    ip = commands.add_parser("info", help="describe a dataset")
+    ip.add_argument("directory")
+    ip.set_defaults(run=cmdinfo)
+
+    args = parser.parse_args(argv)
+    args.run(args)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,784 @@
+import random
+import typing
+from enum import Enum, IntFlag
+from collections import deque
+from itertools import islice
+import numpy as np
+
+from DesignPatterns.EventBus.EventBus import *
+
+##########################################################
+# This section contains the Tetris game
+# and logic itself. 
+# Including:
+# Shapes and rotation tables
+# Pieces
+# Tetris Logic
+##########################################################
+
+class Pieces(Enum):
+    IPiece = 0
+    JPiece = 1
+    SPiece = 2
+    ZPiece = 3
+    LPiece = 4
+    TPiece = 5
+    OPiece = 6
+
+# Controller input of one tick as a bitfield, see Tetris.act.
+class Action(IntFlag):
+    NONE = 0
+    LEFT = 1
+    RIGHT = 2
+    ROTATELEFT = 4
+    ROTATERIGHT = 8
+    SOFTDROP = 16
+    FASTDROP = 32
+
+# Score for clearing 0..4 lines with one piece
+SCORES = (0, 40, 100, 300, 1200)
+
+# Events on Tetris.events, published when a piece locks
+class PieceLocked(typing.NamedTuple):
+    tetris: object
+    type: int
+    rotation: int
+    row: int
+    col: int
+
+class LinesCleared(typing.NamedTuple):
+    tetris: object
+    rows: tuple
+    count: int
+
+class ScoreChanged(typing.NamedTuple):
+    tetris: object
+    score: int
+    delta: int
+
+class GameOver(typing.NamedTuple):
+    tetris: object
+    score: int
+    lines: int
+    pieces: int
+
+class Shape():
+    # One rotation state of a piece, built once at import. Only the occupied
+    # bounding box is kept: one row mask per occupied row, shifted so that
+    # bit 0 is the leftmost occupied column. profile holds the lowest
+    # occupied row of every column from left to right (tops the highest),
+    # counts the cells per row mask, and kicks the
+    # offsets tried in order when rotating into this state.
+    def __init__(self, matrix, rotation, kicks):
+        rows, cols = np.nonzero(matrix)
+        self.matrix = matrix
+        self.rotation = rotation
+        self.kicks = kicks
+        self.top, self.bottom = int(rows.min()), int(rows.max())
+        self.left, self.right = int(cols.min()), int(cols.max())
+        self.cells = (rows, cols)
+        self.value = matrix[rows[0], cols[0]]
+        self.masks = tuple(
+            sum(1 << int(j - self.left) for j in np.nonzero(matrix[i])[0])
+            for i in range(self.top, self.bottom+1))
+        self.profile = tuple(
+            int(rows[cols == j].max()) for j in range(self.left, self.right+1))
+        self.tops = tuple(
+            int(rows[cols == j].min()) for j in range(self.left, self.right+1))
+        self.counts = tuple(bin(mask).count("1") for mask in self.masks)
+
+class Piece():
+    # A piece is only its type and rotation, everything else is looked up
+    # in ROTATIONS.
+    __slots__ = ("type", "rotation")
+
+    def __init__(self, type, rotation=0):
+        self.type = type
+        self.rotation = rotation
+
+    @property
+    def shape(self):
+        return ROTATIONS[self.type][self.rotation]
+
+    @property
+    def matrix(self):
+        return ROTATIONS[self.type][self.rotation].matrix
+
+    @property
+    def color(self):
+        return PALETTE[self.type+1]
+
+    def rotateLeft(self):
+        return (self.rotation+1) % 4
+
+    def rotateRight(self):
+        return (self.rotation+3) % 4
+
+
+
+class IPiece(Piece):
+    color = (0,240,240)
+    kicks = ((0,0),(0,-1),(0,1),(0,-2),(0,2))
+    base = np.array(
+            [
+            0,0,0,0,
+            1,1,1,1,
+            0,0,0,0,
+            0,0,0,0], dtype=np.uint8).reshape((4,4))
+
+    def __init__(self, rotation=0):
+        super().__init__(Pieces.IPiece.value, rotation)
+
+class JPiece(Piece):
+    color = (0,0,240)
+    kicks = ((0,0),(0,-1),(0,1))
+    base = np.array(
+            [
+            0,0,1,0,
+            0,0,1,0,
+            0,1,1,0,
+            0,0,0,0], dtype=np.uint8).reshape((4,4))
+
+    def __init__(self, rotation=0):
+        super().__init__(Pieces.JPiece.value, rotation)
+
+class LPiece(Piece):
+    color = (240,160,0)
+    kicks = ((0,0),(0,-1),(0,1))
+    base = np.array(
+            [
+            0,1,0,0,
+            0,1,0,0,
+            0,1,1,0,
+            0,0,0,0], dtype=np.uint8).reshape((4,4))
+
+    def __init__(self, rotation=0):
+        super().__init__(Pieces.LPiece.value, rotation)
+
+class OPiece(Piece):
+    color = (240,240,0)
+    kicks = ((0,0),)
+    base = np.array(
+            [
+            0,0,0,0,
+            0,1,1,0,
+            0,1,1,0,
+            0,0,0,0], dtype=np.uint8).reshape((4,4))
+
+    def __init__(self, rotation=0):
+        super().__init__(Pieces.OPiece.value, rotation)
+
+class SPiece(Piece):
+    color = (0,240,0)
+    kicks = ((0,0),(0,-1),(0,1))
+    base = np.array(
+            [
+            0,0,0,0,
+            0,0,1,1,
+            0,1,1,0,
+            0,0,0,0], dtype=np.uint8).reshape((4,4))
+
+    def __init__(self, rotation=0):
+        super().__init__(Pieces.SPiece.value, rotation)
+
+class TPiece(Piece):
+    color = (160,0,240)
+    kicks = ((0,0),(0,-1),(0,1))
+    base = np.array(
+            [
+            0,0,0,0,
+            0,0,1,0,
+            0,1,1,1,
+            0,0,0,0], dtype=np.uint8).reshape((4,4))
+
+    def __init__(self, rotation=0):
+        super().__init__(Pieces.TPiece.value, rotation)
+
+class ZPiece(Piece):
+    color = (240,0,0)
+    kicks = ((0,0),(0,-1),(0,1))
+    base = np.array(
+            [
+            0,0,0,0,
+            1,1,0,0,
+            0,1,1,0,
+            0,0,0,0], dtype=np.uint8).reshape((4,4))
+
+    def __init__(self, rotation=0):
+        super().__init__(Pieces.ZPiece.value, rotation)
+
+# Piece classes indexed by Pieces value.
+PIECECLASSES = (IPiece, JPiece, SPiece, ZPiece, LPiece, TPiece, OPiece)
+
+# Colours of the palette grid, indexed by the value stored in a cell.
+# 0 is an empty cell, piece type t is stored as t+1.
+PALETTE = [None] + [cls.color for cls in PIECECLASSES]
+# Rows sent by opponents, see Tetris.addgarbage
+GARBAGETILE = len(PALETTE)
+PALETTE.append((120,120,120))
+
+# ROTATIONS[type][rotation] -> Shape. Rotation k is the base matrix
+# rotated left k times.
+ROTATIONS = tuple(
+        tuple(Shape((t+1)*np.rot90(cls.base, k), k, cls.kicks) for k in range(4))
+        for t, cls in enumerate(PIECECLASSES))
+
+# Zobrist-style board hashing. Every (row, contents) pair gets a 64 bit key
+# from splitmix64, so no table is needed for any board width, and an empty
+# row contributes nothing. The hash of a board is the xor of its row keys.
+MASK64 = (1 << 64) - 1
+
+def rowkey(row, bits):
+    if not bits:
+        return 0
+    z = (((row << 32) | bits) + 0x9E3779B97F4A7C15) & MASK64
+    z = ((z ^ (z >> 30)) * 0xBF58476D1CE4E5B9) & MASK64
+    z = ((z ^ (z >> 27)) * 0x94D049BB133111EB) & MASK64
+    return z ^ (z >> 31)
+
+def boardhash(bits, start=0, stop=None):
+    h = 0
+    for r in range(start, len(bits) if stop is None else stop):
+        h ^= rowkey(r, bits[r])
+    return h
+
+class Randomizer(Enum):
+    uniform = 1
+    bag = 2
+
+class PieceGenerator():
+    # Seeded piece stream of one game. Pieces are generated lazily, seven
+    # at a time: a shuffled bag of all seven pieces, or seven independent
+    # uniform draws. The same seed always gives the same stream.
+    def __init__(self, seed=None, randomizer=Randomizer.uniform):
+        self.rng = random.Random(seed)
+        self.randomizer = randomizer
+        self.queue = deque()
+
+    def refill(self):
+        if self.randomizer is Randomizer.bag:
+            batch = list(range(len(Pieces)))
+            self.rng.shuffle(batch)
+        else:
+            batch = [self.rng.randrange(len(Pieces)) for _ in range(len(Pieces))]
+        self.queue.extend(batch)
+
+    def next(self):
+        if not self.queue:
+            self.refill()
+        return Piece(self.queue.popleft())
+
+    def peek(self, n):
+        # Types of the next n pieces without taking them
+        while len(self.queue) < n:
+            self.refill()
+        return list(islice(self.queue, n))
+
+    def pushback(self, piece):
+        self.queue.appendleft(piece.type)
+
+    def getstate(self):
+        return (self.rng.getstate(), tuple(self.queue))
+
+    def setstate(self, state):
+        self.rng.setstate(state[0])
+        self.queue = deque(state[1])
+
+class Tetris():
+    def __init__(self, rows, cols, seed=None, randomizer=Randomizer.uniform, board=None):
+        self.rows, self.cols = (rows,cols)
+        # Bitboard: one int per row, bit j set when column j is occupied.
+        # board only holds palette indices and is used for rendering. It is
+        # only ever written in place, so a caller can pass the (rows, cols)
+        # uint8 array to use, e.g. in shared memory, and keep views of it.
+        self.bits = [0]*self.rows
+        self.full = (1 << self.cols) - 1
+        if board is None:
+            board = np.zeros((self.rows,self.cols), dtype=np.uint8)
+        else:
+            board[:] = 0
+        self.board = board
+        self.hash = 0
+        # Kept up to date by blitpiecetoboard and clearlines: cells per row,
+        # column heights, occupied cells and rows filled by the last blit
+        self.fill = [0]*self.rows
+        self.heights = [0]*self.cols
+        self.cells = 0
+        self.completed = []
+        # Undo stack of apply
+        self.history = []
+        # Games always get a concrete seed so they can be replayed
+        self.seed = random.randrange(1 << 63) if seed is None else seed
+        self.generator = PieceGenerator(self.seed, randomizer)
+        self.cpiece = self.generator.next()
+        self.npiece = self.generator.next()
+
+        self.offset = (0,3)
+        self.score = 0
+        self.lines = 0
+        self.pieces = 0
+        self.tickcap = 20
+        self.ticks = 0
+
+        self.running = True
+        self.busy = False
+
+        self.moveLeft = False
+        self.moveRight = False
+        self.moveDown = False
+        self.rotateRight = False
+        self.rotateLeft = False
+
+        # Optional input recorder, see replay.InputLog
+        self.recorder = None
+        self.events = EventBus()
+
+    def update(self):
+        if not self.running:
+            return
+        if self.recorder is not None:
+            self.recorder.record(self)
+        self.ticks +=1
+        if(self.ticks % 3 == 0): self.domoves()
+        if(self.ticks % 1 == 0): self.dorotations()
+
+        if self.ticks >= self.tickcap:
+            self.ticks = 0
+            self.fall()
+        if self.recorder is not None:
+            self.recorder.settle(self)
+
+    def fall(self):
+        if self.collisionx(1,self.cpiece.shape) or self.collisionpiece((1,0),self.cpiece.shape): 
+            self.lock()
+        else:
+            self.move((1,0))
+
+    def lock(self, publish=True):
+        piece, offset = ((self.cpiece.type, self.cpiece.rotation), self.offset)
+        self.recover()
+        completed = self.completed
+        cleared = self.clearlines()
+        self.pieces += 1
+        self.lines += cleared
+        self.score += SCORES[cleared]
+        if publish and self.events:
+            self.publish(piece, offset, completed, cleared)
+
+    def publish(self, piece, offset, completed, cleared):
+        events = self.events
+        events.publish(PieceLocked(self, *piece, *offset))
+        if cleared:
+            events.publish(LinesCleared(self, tuple(sorted(completed)), cleared))
+            events.publish(ScoreChanged(self, self.score, SCORES[cleared]))
+        if not self.running:
+            events.publish(GameOver(self, self.score, self.lines, self.pieces))
+
+    def act(self, action):
+        # Same flags the controllers set: moves are held, rotations stay
+        # latched until they succeed.
+        self.moveLeft = bool(action & Action.LEFT)
+        self.moveRight = bool(action & Action.RIGHT)
+        if action & Action.ROTATELEFT: self.rotateLeft = True
+        if action & Action.ROTATERIGHT: self.rotateRight = True
+        if action & Action.FASTDROP: self.tickcap = 1
+        elif action & Action.SOFTDROP: self.tickcap = 3
+        else: self.tickcap = 20
+
+    def controls(self):
+        # The Action that act would need to recreate the current flags
+        action = Action.NONE
+        if self.moveLeft: action |= Action.LEFT
+        if self.moveRight: action |= Action.RIGHT
+        if self.rotateLeft: action |= Action.ROTATELEFT
+        if self.rotateRight: action |= Action.ROTATERIGHT
+        if self.tickcap == 1: action |= Action.FASTDROP
+        elif self.tickcap == 3: action |= Action.SOFTDROP
+        return action
+
+    def domoves(self):
+        if self.busy:
+            return
+        if self.moveLeft and not self.collisiony(-1,self.cpiece.shape) and not self.collisionpiece((0,-1),self.cpiece.shape):
+            self.move((0,-1))
+        if self.moveRight and not self.collisiony(1,self.cpiece.shape) and not self.collisionpiece((0,1),self.cpiece.shape):
+            self.move((0,1))
+    
+    def dorotations(self):
+        if self.busy:
+            return
+        if self.rotateLeft and self.rotate(self.cpiece.rotateLeft()):
+            self.rotateLeft = False
+        if self.rotateRight and self.rotate(self.cpiece.rotateRight()):
+            self.rotateRight = False
+
+    def rotate(self, rotation):
+        shape = ROTATIONS[self.cpiece.type][rotation]
+        for kick in shape.kicks:
+            if( not self.collisionx(kick[0],shape) 
+                and not self.collisiony(kick[1],shape)
+                and not self.collisionpiece(kick,shape)):
+                self.cpiece.rotation = rotation
+                self.move(kick)
+                return True
+        return False
+
+    def recover(self):
+        self.blitpiecetoboard()
+        self.cpiece = self.npiece
+        self.npiece = self.nextpiece()
+        self.offset = (0,3)
+        if self.collisionpiece((0,0),self.cpiece.shape):
+            self.running = False
+
+    def nextpiece(self):
+        return self.generator.next()
+
+    def preview(self, n):
+        # The next n pieces, starting with npiece
+        return [self.npiece] + [Piece(t) for t in self.generator.peek(n-1)]
+
+    ##########################################################
+    # Search support
+    # snapshot/restore copy the whole mutable state. apply
+    # locks the falling piece at a placement and undo takes
+    # it back, saving only the rows the lock can change.
+    ##########################################################
+
+    def snapshot(self):
+        return (list(self.bits), list(self.fill), list(self.heights), self.board.copy(),
+                self.cells, self.hash, (self.cpiece.type, self.cpiece.rotation),
+                (self.npiece.type, self.npiece.rotation), self.offset, self.score,
+                self.lines, self.pieces, self.ticks, self.running,
+                self.generator.getstate(), (self.moveLeft, self.moveRight,
+                self.rotateLeft, self.rotateRight, self.tickcap))
+
+    def restore(self, snapshot):
+        # Drops the undo history
+        (bits, fill, heights, board, self.cells, self.hash, cpiece, npiece, self.offset,
+                self.score, self.lines, self.pieces, self.ticks, self.running, generator,
+                controls) = snapshot
+        self.moveLeft, self.moveRight, self.rotateLeft, self.rotateRight, self.tickcap = controls
+        self.bits, self.fill, self.heights = (list(bits), list(fill), list(heights))
+        self.board[:] = board
+        self.cpiece, self.npiece = (Piece(*cpiece), Piece(*npiece))
+        self.generator.setstate(generator)
+        self.completed = []
+        self.history = []
+
+    def apply(self, placement, publish=False):
+        # placement is anything with type, rotation, row and col for the
+        # falling piece, e.g. ai.Placement. Placements are speculative
+        # unless publish is set: undo cannot take events back.
+        if placement.type != self.cpiece.type:
+            raise ValueError("placement is for another piece type")
+        shape = ROTATIONS[placement.type][placement.rotation]
+        # A line clear moves every row from the stack top down to the
+        # lowest row of the piece
+        lo = min(self.rows-max(self.heights), placement.row+shape.top)
+        hi = placement.row+shape.bottom+1
+        self.history.append((lo, self.bits[lo:hi], self.fill[lo:hi], self.board[lo:hi].copy(),
+                list(self.heights), self.cells, self.hash, self.cpiece, self.cpiece.rotation,
+                self.npiece, self.offset, self.score, self.lines, self.pieces, self.ticks,
+                self.running))
+        self.cpiece.rotation = placement.rotation
+        self.offset = (placement.row, placement.col)
+        self.ticks = 0
+        self.lock(publish)
+
+    def undo(self):
+        (lo, bits, fill, board, self.heights, self.cells, self.hash, self.cpiece, rotation,
+                npiece, self.offset, self.score, self.lines, self.pieces, self.ticks,
+                self.running) = self.history.pop()
+        hi = lo+len(bits)
+        self.bits[lo:hi] = bits
+        self.fill[lo:hi] = fill
+        self.board[lo:hi] = board
+        self.cpiece.rotation = rotation
+        # The piece generated by the lock goes back to the queue
+        self.generator.pushback(self.npiece)
+        self.npiece = npiece
+        self.completed = []
+
+    def move(self,pos):
+        self.offset = (self.offset[0]+pos[0],self.offset[1]+pos[1])
+
+    def blitpiecetoboard(self):
+        shape = self.cpiece.shape
+        r, c = (self.offset[0]+shape.top, self.offset[1]+shape.left)
+        for i, mask in enumerate(shape.masks):
+            old = self.bits[r+i]
+            self.bits[r+i] = old | (mask << c)
+            self.hash ^= rowkey(r+i, old) ^ rowkey(r+i, self.bits[r+i])
+            self.fill[r+i] += shape.counts[i]
+            if self.fill[r+i] == self.cols:
+                self.completed.append(r+i)
+        for j, top in enumerate(shape.tops):
+            self.heights[c+j] = max(self.heights[c+j], self.rows-self.offset[0]-top)
+        self.cells += len(shape.cells[0])
+        self.board[shape.cells[0]+self.offset[0], shape.cells[1]+self.offset[1]] = shape.value
+
+    # The collision checks expect a Shape. collisionx and collisiony only
+    # look at the bounding box, collisionpiece assumes the shape is inside
+    # the board and ands its row masks with the bitboard. Garbage can push
+    # the piece's offset above the board, so the top is checked too.
+    def collisionx(self,x,shape):
+        r = self.offset[0]+x
+        return r+shape.top < 0 or r+shape.bottom > self.rows-1
+    
+    def collisiony(self, y,shape):
+        c = self.offset[1]+y
+        return c+shape.left < 0 or c+shape.right > self.cols-1
+
+    def collisionpiece(self,pos,shape):
+        r, c = (self.offset[0]+pos[0]+shape.top, self.offset[1]+pos[1]+shape.left)
+        for i, mask in enumerate(shape.masks):
+            if self.bits[r+i] & (mask << c):
+                return True
+        return False
+    
+    def fits(self, shape, offset):
+        # All three collision checks at once for any shape and offset
+        r, c = offset
+        if r+shape.top < 0 or r+shape.bottom > self.rows-1 or c+shape.left < 0 or c+shape.right > self.cols-1:
+            return False
+        r, c = (r+shape.top, c+shape.left)
+        for i, mask in enumerate(shape.masks):
+            if self.bits[r+i] & (mask << c):
+                return False
+        return True
+
+    def clearlines(self):
+        # Only rows completed by the last blit can be full. The rows above
+        # the lowest of them are compacted downwards in one pass.
+        full = sorted(self.completed)
+        self.completed = []
+        if not full:
+            return 0
+        top = self.rows - max(self.heights)
+        stop = full[-1] + 1
+        self.hash ^= boardhash(self.bits, top, stop)
+
+        keep = [i for i in range(top, stop) if self.fill[i] != self.cols]
+        new = stop - len(keep)
+        self.bits[new:stop] = [self.bits[i] for i in keep]
+        self.fill[new:stop] = [self.fill[i] for i in keep]
+        self.board[new:stop] = self.board[keep]
+        self.bits[top:new] = [0]*(new-top)
+        self.fill[top:new] = [0]*(new-top)
+        self.board[top:new] = 0
+
+        self.hash ^= boardhash(self.bits, new, stop)
+        self.cells -= len(full)*self.cols
+        self.updateheights(top+len(full))
+        return len(full)
+
+    def updateheights(self, top):
+        # Rescan column heights from row top down, stopping once every
+        # column has been found
+        self.heights = [0]*self.cols
+        remaining = self.full
+        for r in range(top, self.rows):
+            found = self.bits[r] & remaining
+            while found:
+                j = (found & -found).bit_length() - 1
+                self.heights[j] = self.rows - r
+                found &= found - 1
+            remaining &= ~self.bits[r]
+            if not remaining:
+                break
+
+    def addgarbage(self, count, hole):
+        # Pushes the stack up count rows and fills the bottom with garbage
+        # open at column hole. The falling piece is pushed up as far as it
+        # has to be. Topping out ends the game.
+        if count <= 0 or not self.running:
+            return
+        self.history = []
+        top = self.rows - max(self.heights)
+        if top < count:
+            self.gameover()
+            return
+        row = self.full & ~(1 << hole)
+        self.bits[:] = self.bits[count:] + [row]*count
+        self.fill[:] = self.fill[count:] + [self.cols-1]*count
+        self.board[:-count] = self.board[count:]
+        self.board[-count:] = GARBAGETILE
+        self.board[-count:, hole] = 0
+        self.heights = [h+count if h or j != hole else 0 for j, h in enumerate(self.heights)]
+        self.cells += count*(self.cols-1)
+        self.hash = boardhash(self.bits)
+
+        shape = self.cpiece.shape
+        for up in range(count+1):
+            if self.offset[0]-up+shape.top < 0:
+                break
+            if not self.collisionpiece((-up,0), shape):
+                self.move((-up,0))
+                return
+        self.gameover()
+
+    def gameover(self):
+        self.running = False
+        if self.events:
+            self.events.publish(GameOver(self, self.score, self.lines, self.pieces))
+
+    def holes(self):
+        # Empty cells below the top of their column
+        return sum(self.heights) - self.cells
+
+    def linefull(self, line):
+        return line == self.full
+
+    def prettyprint(self):
+        for i in self.board:
+            for j in i:
+                if j:
+                    print("T ",end="")
+                else: print("N ",end="")
+            print()
+
+
+##########################################################
+# Batched Tetris
+# N games stepped together with array operations.
+# Follows the same rules as Tetris.update, one tick per
+# step. Board i draws its pieces from a PieceGenerator
+# seeded with seed+i, so it plays the same pieces as
+# Tetris(rows, cols, seed+i) and its input can be
+# replayed as an InputLog with that seed.
+##########################################################
+
+# ROTATIONS as arrays indexed by [type, rotation]. Masks and cells
+# are padded to 4 rows, kicks are padded by repeating (0,0).
+TABLEMASKS = np.array([[s.masks + (0,)*(4-len(s.masks)) for s in t] for t in ROTATIONS], dtype=np.int64)
+TABLETOP = np.array([[s.top for s in t] for t in ROTATIONS])
+TABLEBOTTOM = np.array([[s.bottom for s in t] for t in ROTATIONS])
+TABLELEFT = np.array([[s.left for s in t] for t in ROTATIONS])
+TABLERIGHT = np.array([[s.right for s in t] for t in ROTATIONS])
+TABLECELLS = np.array([[np.stack(s.cells, 1) for s in t] for t in ROTATIONS])
+TABLEKICKS = np.array([[((0,0),)*(5-len(s.kicks)) + s.kicks for s in t] for t in ROTATIONS])
+
+class BatchTetris():
+    def __init__(self, n, rows, cols, seed=None, randomizer=Randomizer.uniform):
+        self.n, self.rows, self.cols = (n, rows, cols)
+        self.full = (1 << self.cols) - 1
+        self.all = np.arange(self.n)
+        seed = random.randrange(1 << 63) if seed is None else seed
+        self.seeds = [seed+i for i in range(self.n)]
+        self.generators = [PieceGenerator(s, randomizer) for s in self.seeds]
+
+        self.bits = np.zeros((self.n,self.rows), dtype=np.min_scalar_type(self.full))
+        self.board = np.zeros((self.n,self.rows,self.cols), dtype=np.uint8)
+
+        # Active piece as (type, rotation) with its offset, and the preview
+        self.ctype = self.draw(self.all)
+        self.ntype = self.draw(self.all)
+        self.crot = np.zeros(self.n, dtype=np.int64)
+        self.orow = np.zeros(self.n, dtype=np.int64)
+        self.ocol = np.full(self.n, 3, dtype=np.int64)
+
+        self.ticks = np.zeros(self.n, dtype=np.int64)
+        self.score = np.zeros(self.n, dtype=np.int64)
+        self.lines = np.zeros(self.n, dtype=np.int64)
+        self.pieces = np.zeros(self.n, dtype=np.int64)
+        self.running = np.ones(self.n, dtype=bool)
+        self.rotateLeft = np.zeros(self.n, dtype=bool)
+        self.rotateRight = np.zeros(self.n, dtype=bool)
+
+    def draw(self, idx):
+        # Next piece type of every board in idx
+        return np.fromiter((self.generators[i].next().type for i in idx), dtype=np.int64, count=len(idx))
+
+    def fits(self, idx, types, rots, rows, cols):
+        # Vectorized collisionx, collisiony and collisionpiece together:
+        # True where the shape is inside the board and hits nothing.
+        inside = ((rows+TABLETOP[types,rots] >= 0)
+                & (rows+TABLEBOTTOM[types,rots] <= self.rows-1)
+                & (cols+TABLELEFT[types,rots] >= 0)
+                & (cols+TABLERIGHT[types,rots] <= self.cols-1))
+        r = np.minimum((rows+TABLETOP[types,rots])[:,None] + np.arange(4), self.rows-1)
+        shift = np.maximum(cols+TABLELEFT[types,rots], 0)
+        hit = (self.bits[idx[:,None],r] & (TABLEMASKS[types,rots] << shift[:,None])).any(1)
+        return inside & ~hit
+
+    def step(self, actions):
+        actions = np.broadcast_to(np.asarray(actions), (self.n,))
+        live = self.running
+        self.rotateLeft |= live & (actions & Action.ROTATELEFT != 0)
+        self.rotateRight |= live & (actions & Action.ROTATERIGHT != 0)
+        tickcap = np.where(actions & Action.FASTDROP, 1, np.where(actions & Action.SOFTDROP, 3, 20))
+
+        self.ticks[live] += 1
+        moving = live & (self.ticks % 3 == 0)
+        self.domove(moving & (actions & Action.LEFT != 0), -1)
+        self.domove(moving & (actions & Action.RIGHT != 0), 1)
+        self.dorotation(live & self.rotateLeft, 1, self.rotateLeft)
+        self.dorotation(live & self.rotateRight, 3, self.rotateRight)
+
+        falling = live & (self.ticks >= tickcap)
+        self.ticks[falling] = 0
+        idx = self.all[falling]
+        down = self.fits(idx, self.ctype[idx], self.crot[idx], self.orow[idx]+1, self.ocol[idx])
+        self.orow[idx[down]] += 1
+        self.lock(idx[~down])
+
+    def domove(self, mask, dy):
+        idx = self.all[mask]
+        ok = self.fits(idx, self.ctype[idx], self.crot[idx], self.orow[idx], self.ocol[idx]+dy)
+        self.ocol[idx[ok]] += dy
+
+    def dorotation(self, mask, turn, latch):
+        # Kicks are tried in order, a board stops at the first that fits
+        idx = self.all[mask]
+        rots = (self.crot[idx]+turn) % 4
+        kicks = TABLEKICKS[self.ctype[idx],rots]
+        for k in range(kicks.shape[1]):
+            ok = self.fits(idx, self.ctype[idx], rots, self.orow[idx]+kicks[:,k,0], self.ocol[idx]+kicks[:,k,1])
+            done = idx[ok]
+            self.crot[done] = rots[ok]
+            self.orow[done] += kicks[ok,k,0]
+            self.ocol[done] += kicks[ok,k,1]
+            latch[done] = False
+            idx, rots, kicks = (idx[~ok], rots[~ok], kicks[~ok])
+
+    def lock(self, idx):
+        if not len(idx):
+            return
+        # Blit
+        cells = TABLECELLS[self.ctype[idx],self.crot[idx]]
+        r = cells[:,:,0] + self.orow[idx,None]
+        c = cells[:,:,1] + self.ocol[idx,None]
+        b = np.broadcast_to(idx[:,None], r.shape)
+        self.board[b,r,c] = (self.ctype[idx]+1)[:,None]
+        np.bitwise_or.at(self.bits, (b,r), (1 << c).astype(self.bits.dtype))
+
+        # Spawn the preview, game over is checked before lines are cleared
+        self.ctype[idx] = self.ntype[idx]
+        self.ntype[idx] = self.draw(idx)
+        self.crot[idx] = 0
+        self.orow[idx] = 0
+        self.ocol[idx] = 3
+        self.running[idx] = self.fits(idx, self.ctype[idx], self.crot[idx], self.orow[idx], self.ocol[idx])
+
+        cleared = self.clearlines(idx)
+        self.pieces[idx] += 1
+        self.lines[idx] += cleared
+        self.score[idx] += np.take(SCORES, cleared)
+
+    def clearlines(self, idx):
+        full = self.bits[idx] == self.full
+        cleared = full.sum(1)
+        hit = cleared > 0
+        idx, full = (idx[hit], full[hit])
+        if len(idx):
+            # Stable sort puts the full rows on top, then blank them
+            order = np.argsort(~full, axis=1, kind="stable")
+            top = np.arange(self.rows) < cleared[hit][:,None]
+            bits = np.take_along_axis(self.bits[idx], order, 1)
+            bits[top] = 0
+            board = np.take_along_axis(self.board[idx], order[:,:,None], 1)
+            board[top] = 0
+            self.bits[idx] = bits
+            self.board[idx] = board
+        return cleared
@@ -0,0 +1,102 @@
+import subprocess
+import numpy as np
+
+from engine import *
+
+##########################################################
+# Headless framebuffer rendering
+# Same pixels as SinglePlayerRenderer, built with array
+# operations: the palette is looked up per cell, then
+# broadcast over each tile's pixels straight into the
+# output with the 1 pixel tile gaps set to background.
+# Frames are (height, width, 3) uint8, batches add a
+# leading axis.
+##########################################################
+
+BOARDBACKGROUND = (180,180,180)
+PANELBACKGROUND = (60,60,60)
+
+# Palette lookup tables, index 0 is the background of the area
+BOARDLUT = np.array([BOARDBACKGROUND] + list(PALETTE[1:]), dtype=np.uint8)
+PANELLUT = np.array([PANELBACKGROUND] + list(PALETTE[1:]), dtype=np.uint8)
+
+def drawtiles(out, colors, tile, background):
+    # Upscale (n, rows, cols, 3) cell colours into out, which is a
+    # (n, rows*th, cols*tw, 3) view of the frames
+    n, rows, cols = colors.shape[:3]
+    tw, th = tile
+    tiles = out.reshape(n, rows, th, cols, tw, 3)
+    tiles[:] = colors[:, :, None, :, None, :]
+    tiles[:, :, th-1] = background
+    tiles[:, :, :, :, tw-1] = background
+
+def overlay(boards, types, rots, rows, cols):
+    # Palette grids with the falling pieces drawn in
+    grids = boards.copy()
+    n = np.arange(len(grids))[:,None]
+    cells = TABLECELLS[types, rots]
+    grids[n, cells[:,:,0]+rows[:,None], cells[:,:,1]+cols[:,None]] = (types+1)[:,None]
+    return grids
+
+def frames(boards, types, rots, rows, cols, ntypes, nrots=None, tile=(30,30), panelwidth=200, out=None):
+    # Batch of boards with falling piece (types, rots) at (rows, cols) and
+    # preview pieces (ntypes, nrots), e.g. straight from BatchTetris. Pass
+    # the previous result as out to render into it again.
+    boards = np.asarray(boards, dtype=np.uint8)
+    n, r, c = boards.shape
+    tw, th = tile
+    types, rots, rows, cols, ntypes = (np.asarray(a, dtype=np.int64)
+            for a in (types, rots, rows, cols, ntypes))
+    nrots = np.zeros(n, dtype=np.int64) if nrots is None else np.asarray(nrots, dtype=np.int64)
+
+    if out is None:
+        out = np.empty((n, r*th, c*tw+panelwidth, 3), dtype=np.uint8)
+    grids = overlay(boards, types, rots, rows, cols)
+    drawtiles(out[:, :, :c*tw], BOARDLUT[grids], tile, BOARDBACKGROUND)
+
+    # Preview drawn one tile in from the panel's corner, panelwidth=0
+    # renders the board only
+    panel = out[:, :, c*tw:]
+    panel[:] = PANELBACKGROUND
+    if panelwidth < 5*tw:
+        return out
+    previews = np.array([ROTATIONS[t][k].matrix for t, k in zip(ntypes, nrots)], dtype=np.uint8).reshape(n, 4, 4)
+    drawtiles(panel[:, th:5*th, tw:5*tw], PANELLUT[previews], tile, PANELBACKGROUND)
+    return out
+
+def frame(tetris, tile=(30,30), panelwidth=200):
+    return tetrisframes([tetris], tile, panelwidth)[0]
+
+def tetrisframes(games, tile=(30,30), panelwidth=200):
+    return frames(np.stack([t.board for t in games]),
+            [t.cpiece.type for t in games], [t.cpiece.rotation for t in games],
+            [t.offset[0] for t in games], [t.offset[1] for t in games],
+            [t.npiece.type for t in games], [t.npiece.rotation for t in games],
+            tile, panelwidth)
+
+def batchframes(batch, tile=(30,30), panelwidth=200, out=None):
+    return frames(batch.board, batch.ctype, batch.crot, batch.orow, batch.ocol,
+            batch.ntype, None, tile, panelwidth, out)
+
+##########################################################
+# Output
+##########################################################
+
+def savebatch(directory, index, batch):
+    # One numbered .npy file per batch
+    path = "%s/frames_%06d.npy" % (directory, index)
+    np.save(path, batch)
+    return path
+
+def writeraw(stream, batch):
+    # Raw rgb24, frame after frame, without an intermediate bytes copy
+    stream.write(memoryview(np.ascontiguousarray(batch)).cast("B"))
+
+def videopipe(path, width, height, fps=60):
+    # ffmpeg process reading raw rgb24 frames on stdin, feed it with
+    # writeraw(process.stdin, batch) and close stdin when done
+    return subprocess.Popen(
+            ["ffmpeg", "-loglevel", "error", "-y", "-f", "rawvideo", "-pix_fmt", "rgb24",
+            "-s", "%dx%d" % (width, height), "-r", str(fps), "-i", "-",
+            "-pix_fmt", "yuv420p", path],
+            stdin=subprocess.PIPE)
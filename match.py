@@ -0,0 +1,144 @@
+import sys
+import random
+import typing
+import argparse
+from collections import deque
+from functools import partial
+
+from engine import *
+
+##########################################################
+# Matches
+# n boards stepped together, all dealt the same pieces.
+# A line clear queues garbage (GARBAGELINES rows) for a
+# random opponent that is still alive. It first cancels
+# garbage waiting for the sender, and what is left is
+# pushed in under the receiver's stack when its next
+# piece locks. The last board standing wins. Nothing
+# here needs pygame, tetris.py draws matches.
+#
+# python match.py [--players 8] [--agent greedy] ...
+##########################################################
+
+# Garbage rows sent for clearing 0..4 lines with one piece
+GARBAGELINES = (0, 0, 1, 2, 4)
+
+class MatchResult(typing.NamedTuple):
+    seed: int
+    # Board indices, winner first
+    standings: list
+    scores: list
+    lines: list
+    ticks: int
+
+class Match():
+    def __init__(self, n, rows=20, cols=10, seed=None, agents=None, randomizer=Randomizer.uniform):
+        # agents[i] plays board i, None leaves it to act/the controller
+        self.n = n
+        self.seed = random.randrange(1 << 63) if seed is None else seed
+        self.rng = random.Random(self.seed)
+        self.games = [Tetris(rows, cols, self.seed, randomizer) for i in range(n)]
+        self.agents = list(agents) if agents is not None else [None]*n
+        for i, (tetris, agent) in enumerate(zip(self.games, self.agents)):
+            if agent is not None:
+                agent.reset(tetris, self.seed)
+            tetris.events.subscribe(LinesCleared, partial(self.cleared, i))
+            tetris.events.subscribe(PieceLocked, partial(self.locked, i))
+            tetris.events.subscribe(GameOver, partial(self.over, i))
+
+        self.outbox = deque()
+        # Garbage waiting for every board, one entry per clear
+        self.pending = [deque() for i in range(n)]
+        self.lockedboards = []
+        # Boards in the order they topped out
+        self.out = []
+        self.ticks = 0
+
+    @property
+    def running(self):
+        alive = self.n - len(self.out)
+        return alive > 1 or (self.n == 1 and alive == 1)
+
+    def cleared(self, i, event):
+        self.outbox.append((i, GARBAGELINES[event.count]))
+
+    def locked(self, i, event):
+        self.lockedboards.append(i)
+
+    def over(self, i, event):
+        self.out.append(i)
+
+    def step(self, actions=None):
+        # One tick of every board still alive, then the garbage exchange.
+        # actions[i] is used for boards without an agent.
+        for i, tetris in enumerate(self.games):
+            if not tetris.running:
+                continue
+            agent = self.agents[i]
+            if agent is not None:
+                tetris.act(agent.act(tetris))
+            elif actions is not None:
+                tetris.act(actions[i])
+            tetris.update()
+        self.exchange()
+        self.ticks += 1
+        return self.running
+
+    def exchange(self):
+        while self.outbox:
+            sender, lines = self.outbox.popleft()
+            incoming = self.pending[sender]
+            while lines and incoming:
+                cancel = min(lines, incoming[0])
+                lines -= cancel
+                incoming[0] -= cancel
+                if not incoming[0]:
+                    incoming.popleft()
+            targets = [j for j, t in enumerate(self.games) if j != sender and t.running]
+            if lines and targets:
+                self.pending[self.rng.choice(targets)].append(lines)
+
+        for i in self.lockedboards:
+            tetris = self.games[i]
+            if self.pending[i] and tetris.running:
+                tetris.addgarbage(sum(self.pending[i]), self.rng.randrange(tetris.cols))
+                self.pending[i].clear()
+        self.lockedboards.clear()
+
+    def standings(self):
+        # Boards still alive by score, then the others, last out first
+        alive = [i for i in range(self.n) if self.games[i].running]
+        alive.sort(key=lambda i: -self.games[i].score)
+        return alive + self.out[::-1]
+
+    def result(self):
+        return MatchResult(self.seed, self.standings(), [t.score for t in self.games],
+                [t.lines for t in self.games], self.ticks)
+
+    def play(self, maxticks=None):
+        # Headless until one board is left or maxticks
+        while self.running and (maxticks is None or self.ticks < maxticks):
+            self.step()
+        return self.result()
+
+##########################################################
+# Command line
+##########################################################
+
+def main(argv=None):
+    import ai
+    parser = argparse.ArgumentParser(description="Play a headless match between agents")
+    parser.add_argument("--players", type=int, default=8)
+    parser.add_argument("--agent", choices=sorted(ai.AGENTS), default="greedy")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--maxticks", type=int, default=None)
+    args = parser.parse_args(argv)
+
+    match = Match(args.players, seed=args.seed, agents=[ai.AGENTS[args.agent]() for i in range(args.players)])
+    result = match.play(args.maxticks)
+    print("seed %d, %d ticks" % (result.seed, result.ticks))
+    for place, i in enumerate(result.standings, 1):
+        print("%3d. board %-3d score %-7d lines %d" % (place, i, result.scores[i], result.lines[i]))
+
+if __name__ == "__main__":
+    main()
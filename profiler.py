@@ -0,0 +1,84 @@
+import json
+import time
+import numpy as np
+
+##########################################################
+# Frame profiler
+# Game.run marks the end of every phase of a frame, and
+# the timestamps go into a preallocated ring buffer,
+# one row per frame. Percentiles and Chrome traces are
+# computed from it only when asked for. Disabled, the
+# game holds a NullProfiler whose marks do nothing.
+##########################################################
+
+PHASES = ("events", "update", "render", "display", "wait")
+# Column of the timestamp that ends each phase, column 0 starts the frame
+EVENTS, UPDATE, RENDER, DISPLAY, WAIT = range(1, len(PHASES)+1)
+
+class NullProfiler():
+    enabled = False
+
+    def start(self):
+        pass
+
+    def mark(self, phase):
+        pass
+
+class FrameProfiler():
+    enabled = True
+
+    def __init__(self, capacity=1024):
+        self.capacity = capacity
+        self.marks = np.zeros((capacity, len(PHASES)+1))
+        self.frames = 0
+        self.row = self.marks[0]
+        self.clock = time.perf_counter
+
+    def start(self):
+        self.row = self.marks[self.frames % self.capacity]
+        self.frames += 1
+        self.row[:] = self.clock()
+
+    def mark(self, phase):
+        self.row[phase] = self.clock()
+
+    def recorded(self):
+        # Complete frames in the buffer, oldest first. The current frame
+        # is still being marked.
+        n = min(self.frames-1, self.capacity-1)
+        if n <= 0:
+            return self.marks[:0]
+        last = (self.frames-1) % self.capacity
+        return np.roll(self.marks, -last, axis=0)[-n:]
+
+    def durations(self):
+        # (frames, phases) seconds, with the whole frame as a last column
+        marks = self.recorded()
+        return np.hstack([np.diff(marks, axis=1), marks[:, -1:]-marks[:, :1]])
+
+    def percentiles(self, q=(50, 95, 99)):
+        # {phase: [p50, p95, p99]} in seconds, "frame" for the whole frame
+        durations = self.durations()
+        if not len(durations):
+            return {}
+        values = np.percentile(durations, q, axis=0)
+        return {name: values[:, i].tolist() for i, name in enumerate(PHASES + ("frame",))}
+
+    def trace(self):
+        # Chrome trace format, open in chrome://tracing or Perfetto
+        events = []
+        marks = self.recorded()
+        first = self.frames-1-len(marks)
+        for i, row in enumerate(marks):
+            us = (row-marks[0, 0])*1e6
+            events.append({"name": "frame", "ph": "X", "pid": 1, "tid": 1,
+                    "ts": us[0], "dur": us[-1]-us[0], "args": {"frame": first+i}})
+            for phase, name in enumerate(PHASES, 1):
+                events.append({"name": name, "ph": "X", "pid": 1, "tid": 1,
+                        "ts": us[phase-1], "dur": us[phase]-us[phase-1]})
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def dump(self, path):
+        with open(path, "w") as f:
+            json.dump(self.trace(), f)
+        return path
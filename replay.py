@@ -0,0 +1,144 @@
+import sys
+import time
+import struct
+import argparse
+from bisect import bisect_right
+
+from engine import *
+
+#####################################################
+# Replays
+# A game is fully described by its seed and the
+# controller state at every tick. InputLog records
+# only the ticks where that state changed. Replayer
+# plays a log back headless, as fast as possible,
+# keeping keyframes to seek without starting over.
+#####################################################
+
+# magic, version, rows, cols, randomizer, seed, number of events
+LOGHEADER = struct.Struct("<4sBBBBQI")
+# tick, action
+LOGEVENT = struct.Struct("<IB")
+MAGIC = b"TLOG"
+VERSION = 1
+
+class InputLog():
+    def __init__(self, rows, cols, seed, randomizer=Randomizer.uniform, events=None):
+        self.rows, self.cols = (rows, cols)
+        self.seed = seed
+        self.randomizer = randomizer
+        self.events = events if events is not None else []
+        self.ticks = 0
+        self.last = None
+
+    @staticmethod
+    def start(tetris):
+        # Records a fresh game from its first tick on
+        log = InputLog(tetris.rows, tetris.cols, tetris.seed, tetris.generator.randomizer)
+        tetris.recorder = log
+        return log
+
+    def record(self, tetris):
+        # Called by Tetris.update before every tick. Input is logged when it
+        # differs from the flags the previous tick left behind, which is
+        # what a replay has at that point. A successful rotation clears its
+        # flag, so pressing it again has to be logged.
+        action = tetris.controls()
+        if action != self.last:
+            self.events.append((self.ticks, int(action)))
+        self.ticks += 1
+
+    def settle(self, tetris):
+        # Called by Tetris.update after every tick
+        self.last = tetris.controls()
+
+    def save(self, path):
+        with open(path, "wb") as f:
+            f.write(LOGHEADER.pack(MAGIC, VERSION, self.rows, self.cols,
+                    self.randomizer.value, self.seed, len(self.events)))
+            f.write(b"".join(LOGEVENT.pack(*event) for event in self.events))
+
+    @staticmethod
+    def load(path):
+        with open(path, "rb") as f:
+            data = f.read()
+        magic, version, rows, cols, randomizer, seed, count = LOGHEADER.unpack_from(data)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("%s is not a version %d input log" % (path, VERSION))
+        events = list(LOGEVENT.iter_unpack(data[LOGHEADER.size:LOGHEADER.size+count*LOGEVENT.size]))
+        return InputLog(rows, cols, seed, Randomizer(randomizer), events)
+
+class Replayer():
+    # Ticks between keyframes
+    INTERVAL = 1024
+
+    def __init__(self, log, interval=INTERVAL):
+        self.log = log
+        self.interval = interval
+        self.tetris = Tetris(log.rows, log.cols, log.seed, log.randomizer)
+        self.tick = 0
+        self.event = 0
+        self.keyticks = [0]
+        self.keyframes = [(self.tetris.snapshot(), 0)]
+
+    def seek(self, tick):
+        # State after the first tick updates, from the nearest keyframe
+        i = bisect_right(self.keyticks, tick) - 1
+        if tick < self.tick or self.keyticks[i] > self.tick:
+            snapshot, self.event = self.keyframes[i]
+            self.tetris.restore(snapshot)
+            self.tick = self.keyticks[i]
+        self.run(tick)
+        return self.tetris
+
+    def run(self, stop=None):
+        # Plays until tick stop or the end of the game. Ticks that can only
+        # count up to the next gravity step, or with just moves held up to
+        # the next tick that moves, are skipped in one go.
+        tetris = self.tetris
+        events = self.log.events
+        stop = sys.maxsize if stop is None else stop
+        while self.tick < stop and tetris.running:
+            if self.event < len(events) and events[self.event][0] == self.tick:
+                tetris.act(Action(events[self.event][1]))
+                self.event += 1
+            nextevent = events[self.event][0] if self.event < len(events) else stop
+            nextkey = (self.tick//self.interval + 1)*self.interval
+
+            idle = tetris.tickcap - 1 - tetris.ticks
+            if tetris.rotateLeft or tetris.rotateRight:
+                idle = 0
+            elif tetris.moveLeft or tetris.moveRight:
+                # Moves run when ticks reaches a multiple of 3
+                idle = min(idle, 2 - tetris.ticks % 3)
+            if idle > 0:
+                skip = min(idle, min(nextevent, nextkey, stop) - self.tick)
+                tetris.ticks += skip
+                self.tick += skip
+            else:
+                tetris.update()
+                self.tick += 1
+
+            if self.tick == nextkey and nextkey > self.keyticks[-1]:
+                self.keyticks.append(self.tick)
+                self.keyframes.append((tetris.snapshot(), self.event))
+        return tetris
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Play back a Tetris input log headless")
+    parser.add_argument("log")
+    parser.add_argument("--tick", type=int, default=None, help="stop at this tick, default: game over")
+    args = parser.parse_args(argv)
+
+    replayer = Replayer(InputLog.load(args.log))
+    start = time.perf_counter()
+    tetris = replayer.seek(args.tick) if args.tick is not None else replayer.run()
+    elapsed = time.perf_counter()-start
+
+    tetris.prettyprint()
+    print("tick %d, score %d, lines %d, pieces %d%s" % (replayer.tick, tetris.score,
+            tetris.lines, tetris.pieces, "" if tetris.running else ", game over"))
+    print("%.0f ticks/ms" % (replayer.tick/max(elapsed, 1e-9)/1000))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,174 @@
+import asyncio
+import argparse
+
+from engine import *
+from Iinput import *
+from Ioutput import *
+
+#####################################################
+# Game server
+# Hosts headless Tetris sessions, one per TCP
+# connection, in a single asyncio loop. All sessions
+# advance together on a fixed tick. Reading input is
+# one coroutine per client and output is only ever
+# buffered, so a slow client cannot hold up a tick.
+# Clients get a keyframe on connect and deltas after
+# every tick, see Ioutput.py.
+#####################################################
+
+class HeadlessController():
+    # Same as the ServerInput of the pygame controllers: every received
+    # Action replaces the held input, rotations stay latched
+    def ServerInput(self, actions, tetris):
+        for action in actions:
+            tetris.act(action)
+
+class Session():
+    def __init__(self, id, tetris, reader, writer):
+        self.id = id
+        self.tetris = tetris
+        self.reader = reader
+        self.writer = writer
+        self.actions = []
+        self.encoder = StateEncoder(tetris.rows, tetris.cols)
+        self.ticks = 0
+        self.dropped = 0
+
+class GameServer():
+    # Output a client has not taken yet, above this frames are dropped
+    MAXBUFFER = 64*1024
+    # Sessions updated between giving the loop a chance to do I/O
+    SLICE = 64
+    # Ticks the clock may fall behind before the schedule is reset
+    MAXLAG = 10
+
+    def __init__(self, host="127.0.0.1", port=7777, tickrate=60, controller=None, rows=20, cols=10,
+            seed=None, randomizer=Randomizer.uniform):
+        self.host, self.port = (host, port)
+        self.tickrate = tickrate
+        self.controller = controller or HeadlessController()
+        self.rows, self.cols = (rows, cols)
+        # With a seed, session n plays the piece stream of seed+n
+        self.seed = seed
+        self.randomizer = randomizer
+        self.sessions = {}
+        self.nextid = 0
+        self.tick = 0
+        self.server = None
+        self.loop = None
+        self.task = None
+
+    async def serve(self):
+        self.loop = asyncio.get_running_loop()
+        self.task = asyncio.current_task()
+        self.server = await asyncio.start_server(self.connect, self.host, self.port)
+        if not self.port:
+            self.port = self.server.sockets[0].getsockname()[1]
+        try:
+            async with self.server:
+                await self.run()
+        except asyncio.CancelledError:
+            pass
+        finally:
+            self.close()
+
+    def stop(self):
+        # Ends serve from any thread
+        if self.loop is not None and not self.loop.is_closed():
+            self.loop.call_soon_threadsafe(self.task.cancel)
+
+    def close(self):
+        if self.server:
+            self.server.close()
+        for session in list(self.sessions.values()):
+            session.writer.close()
+
+    async def connect(self, reader, writer):
+        session = Session(self.nextid, self.newgame(self.nextid), reader, writer)
+        self.nextid += 1
+        self.sessions[session.id] = session
+        self.send(session)
+        try:
+            while True:
+                data = await reader.read(4096)
+                if not data:
+                    break
+                session.actions += decodeactions(data)
+        except (ConnectionError, asyncio.CancelledError):
+            # Cancelled when stop ends the loop with the client connected
+            pass
+        finally:
+            self.sessions.pop(session.id, None)
+            writer.close()
+
+    def newgame(self, id):
+        seed = None if self.seed is None else self.seed+id
+        return Tetris(self.rows, self.cols, seed, self.randomizer)
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        period = 1/self.tickrate
+        deadline = loop.time()
+        while True:
+            await self.step()
+            deadline += period
+            delay = deadline - loop.time()
+            if delay < -self.MAXLAG*period:
+                # Too far behind to catch up, skip the missed ticks
+                deadline = loop.time()
+            await asyncio.sleep(max(delay, 0))
+
+    async def step(self):
+        self.tick += 1
+        sessions = list(self.sessions.values())
+        for i, session in enumerate(sessions):
+            if i and i % self.SLICE == 0:
+                await asyncio.sleep(0)
+            self.stepsession(session)
+
+    def stepsession(self, session):
+        tetris = session.tetris
+        if not tetris.running:
+            return
+        self.controller.ServerInput(session.actions, tetris)
+        session.actions.clear()
+        tetris.update()
+        session.ticks += 1
+        self.send(session)
+        if not tetris.running:
+            session.writer.close()
+
+    def send(self, session):
+        # A client that stopped reading misses deltas, so it gets a fresh
+        # keyframe once its buffer has drained
+        transport = session.writer.transport
+        if transport.is_closing():
+            return
+        if transport.get_write_buffer_size() > self.MAXBUFFER:
+            session.dropped += 1
+            session.encoder.reset()
+            return
+        data = session.encoder.encode(session.ticks, session.tetris)
+        if data is not None:
+            # data is a view of the encoder's buffer, which the next encode
+            # overwrites while the transport may still hold on to it
+            session.writer.write(bytes(data))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Headless Tetris game server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=7777)
+    parser.add_argument("--tickrate", type=int, default=60)
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--randomizer", choices=[r.name for r in Randomizer], default="uniform")
+    args = parser.parse_args(argv)
+
+    server = GameServer(args.host, args.port, args.tickrate, seed=args.seed,
+            randomizer=Randomizer[args.randomizer])
+    try:
+        asyncio.run(server.serve())
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
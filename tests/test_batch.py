@@ -0,0 +1,54 @@
+import numpy as np
+
+from engine import *
+from replay import *
+
+# BatchTetris must play every board exactly like Tetris.update
+
+def play(randomizer, n=16, seed=3, steps=3000):
+    batch = BatchTetris(n, 20, 10, seed, randomizer)
+    tetrises = [Tetris(20, 10, s, randomizer) for s in batch.seeds]
+    log = InputLog.start(tetrises[0])
+    rng = np.random.default_rng(0)
+    # Half filled boards with one hole per row so lines get cleared
+    holes = rng.integers(0, 10, (n, 10))
+    for i, t in enumerate(tetrises):
+        for r in range(10):
+            t.addgarbage(1, int(holes[i, r]))
+        batch.bits[i] = t.bits
+        batch.board[i] = t.board
+
+    for step in range(steps):
+        actions = rng.choice([0,1,2,4,8,16,32,5,10], n, p=[.3,.15,.15,.1,.1,.05,.05,.05,.05])
+        batch.step(actions)
+        for i, t in enumerate(tetrises):
+            t.act(int(actions[i]))
+            t.update()
+            assert t.running == batch.running[i], (step, i)
+            if not t.running:
+                continue
+            assert (t.board == batch.board[i]).all(), (step, i)
+            assert t.bits == list(batch.bits[i]), (step, i)
+            assert t.offset == (batch.orow[i], batch.ocol[i]), (step, i)
+            assert (t.cpiece.type, t.cpiece.rotation) == (batch.ctype[i], batch.crot[i]), (step, i)
+            assert t.npiece.type == batch.ntype[i], (step, i)
+            assert (t.score, t.lines, t.pieces) == (batch.score[i], batch.lines[i], batch.pieces[i]), (step, i)
+
+    # Board 0 replays from its input log, garbage aside
+    replayer = Replayer(log)
+    for r in range(10):
+        replayer.tetris.addgarbage(1, int(holes[0, r]))
+    replayer.run(steps)
+    assert (replayer.tetris.board == tetrises[0].board).all()
+    return batch
+
+def test_uniform():
+    assert play(Randomizer.uniform).lines.sum() > 0
+
+def test_bag():
+    assert play(Randomizer.bag, seed=2).lines.sum() > 0
+
+def test_streams_per_board():
+    # A board's pieces do not depend on how many boards there are
+    small, large = (BatchTetris(2, 20, 10, 5), BatchTetris(8, 20, 10, 5))
+    assert (small.ctype == large.ctype[:2]).all() and (small.ntype == large.ntype[:2]).all()
@@ -0,0 +1,33 @@
+import gc
+import tracemalloc
+
+from engine import *
+import ai
+
+# TranspositionCache.bytes must match the memory its entries really hold
+
+def test_bytes_match_allocation():
+    cache = ai.TranspositionCache(maxbytes=1 << 19)
+    tracemalloc.start()
+    try:
+        for seed in range(5):
+            t = Tetris(20, 10, seed)
+            agent = ai.GreedyAgent(cache=cache)
+            agent.reset(t, seed)
+            for tick in range(3000):
+                if not t.running:
+                    break
+                t.act(agent.act(t))
+                t.update()
+            ai.BeamAgent(budget=None, cache=cache).choose(t)
+        del t, agent
+        gc.collect()
+        assert cache.evictions and cache.bytes <= cache.maxbytes
+        held = tracemalloc.get_traced_memory()[0]
+        bytes = cache.bytes
+        cache.clear()
+        gc.collect()
+        freed = held - tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+    assert 0.8*bytes <= freed <= 1.25*bytes, (bytes, freed)
@@ -0,0 +1,34 @@
+import numpy as np
+
+from engine import *
+from dataset import *
+import ai
+
+# Every record written comes back exactly once, shuffled or not
+
+def rows(records):
+    # The records as sorted tuples, to compare as multisets
+    n = len(records["piece"])
+    columns = [records[name].reshape(n, -1).tolist() for name in sorted(records)]
+    return sorted(tuple(map(tuple, row)) for row in zip(*columns))
+
+def test_round_trip(tmp_path):
+    directory = str(tmp_path / "positions")
+    games = [recordgame(ai.GreedyAgent(), seed, maxticks=3000) for seed in range(3)]
+    # Small chunks so records span several of them
+    with DatasetWriter(directory, chunksize=100) as writer:
+        for records in games:
+            writer.extend(records)
+    written = {name: np.concatenate([g[name] for g in games]) for name in games[0]}
+    total = len(written["piece"])
+
+    reader = DatasetReader(directory)
+    assert len(reader) == total and len(reader.counts) == -(-total // 100)
+    for shuffle, seed in ((False, None), (True, 1), (True, 2)):
+        batches = list(reader.batches(32, seed, shuffle, window=2))
+        assert all(len(b["piece"]) == 32 for b in batches[:-1])
+        read = {name: np.concatenate([b[name] for b in batches]) for name in written}
+        assert len(read["piece"]) == total
+        assert rows(read) == rows(written)
+        same = all((read[name] == written[name]).all() for name in written)
+        assert same != shuffle
@@ -0,0 +1,28 @@
+import os
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+import pygame
+
+from engine import *
+import framebuffer
+import tetris
+import ai
+
+# framebuffer.frame must give the same pixels BoardView draws
+
+def test_boardview_parity():
+    pygame.init()
+    t = Tetris(20, 10, 3)
+    agent = ai.GreedyAgent()
+    agent.reset(t, 0)
+    renderer = tetris.SinglePlayerRenderer(20, 10)
+    screen = pygame.Surface(renderer.windowsize)
+    for tick in range(2000):
+        if not t.running:
+            break
+        t.act(agent.act(t))
+        t.update()
+        renderer.render(screen, t)
+        if tick % 13 == 0:
+            pixels = pygame.surfarray.array3d(screen).swapaxes(0, 1)
+            assert (pixels == framebuffer.frame(t)).all(), tick
+    assert t.lines > 0
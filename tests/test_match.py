@@ -0,0 +1,70 @@
+import random
+
+from engine import *
+from match import *
+import ai
+
+# Garbage keeps a board's incremental state consistent, and the match
+# cancels garbage before sending it on
+
+def check(t):
+    occupied = t.board != 0
+    assert t.bits == [sum(1 << j for j in range(t.cols) if occupied[i, j]) for i in range(t.rows)]
+    assert t.fill == occupied.sum(1).tolist()
+    assert t.heights == [t.rows - i if occupied[:, j].any() else 0
+            for j, i in enumerate(occupied.argmax(0))]
+    assert t.cells == occupied.sum()
+    assert t.hash == boardhash(t.bits)
+    if t.running:
+        assert t.fits(t.cpiece.shape, t.offset)
+
+def test_addgarbage():
+    rng = random.Random(0)
+    for seed in range(20):
+        t = Tetris(20, 10, seed)
+        agent = ai.GreedyAgent()
+        agent.reset(t, seed)
+        while t.running and t.pieces < 60:
+            t.act(agent.act(t))
+            t.update()
+            if rng.random() < .01:
+                count, hole = (rng.randrange(1, 5), rng.randrange(10))
+                t.addgarbage(count, hole)
+                check(t)
+                if t.running:
+                    assert (t.board[t.rows-count:, hole] == 0).all()
+                    assert (t.board[t.rows-count:] != 0).sum() == count*(t.cols-1)
+
+def test_garbage_above_the_board():
+    # A flat I pushed to row -1 must not rotate against the bottom row
+    t = Tetris(20, 10, 0)
+    t.cpiece = Piece(0, 0)
+    t.addgarbage(19, 4)
+    assert t.offset[0] < 0
+    t.rotateLeft = True
+    t.dorotations()
+    assert t.cpiece.rotation == 0 and t.rotateLeft
+    check(t)
+
+def test_cancelling():
+    m = Match(3, seed=1)
+    a, b, c = m.games
+    # Board 0 has 3 rows waiting, then clears 3 lines (2 rows) and 4 lines
+    # (4 rows): 2 cancel, then 1 more and 3 go to an opponent
+    m.pending[0].append(3)
+    a.events.publish(LinesCleared(a, [], 3))
+    m.exchange()
+    assert list(m.pending[0]) == [1] and not m.pending[1] and not m.pending[2]
+    a.events.publish(LinesCleared(a, [], 4))
+    m.exchange()
+    assert not m.pending[0]
+    target = 1 if m.pending[1] else 2
+    assert list(m.pending[target]) == [3]
+
+    # It is pushed in when the target's next piece locks
+    t = m.games[target]
+    t.events.publish(PieceLocked(t, t.cpiece.type, t.cpiece.rotation, *t.offset))
+    m.exchange()
+    assert not m.pending[target]
+    assert ((t.board[-3:] != 0).sum(1) == t.cols-1).all()
+    check(t)
@@ -0,0 +1,51 @@
+import random
+
+from engine import *
+from Ioutput import *
+from Iinput import *
+import ai
+
+# The decoder must rebuild the encoder's game exactly, however the stream
+# is cut into reads
+
+def same(d, t):
+    return ((d.board == t.board).all() and d.bits == t.bits and d.fill == t.fill
+            and d.heights == t.heights and d.hash == t.hash and d.cells == t.cells
+            and (d.cpiece.type, d.cpiece.rotation, d.offset) == (t.cpiece.type, t.cpiece.rotation, t.offset)
+            and (d.npiece.type, d.npiece.rotation) == (t.npiece.type, t.npiece.rotation)
+            and (d.score, d.lines, d.pieces, d.running) == (t.score, t.lines, t.pieces, t.running))
+
+def test_round_trip():
+    t = Tetris(20, 10, 7)
+    agent = ai.GreedyAgent()
+    agent.reset(t, 0)
+    encoder, decoder = (StateEncoder(20, 10), StateDecoder())
+    stream = bytearray()
+    rng = random.Random(0)
+    for tick in range(6000):
+        if tick == 2000:
+            # Forces a keyframe mid game
+            encoder.reset()
+        data = encoder.encode(tick, t)
+        if data is not None:
+            stream += data
+        while stream and rng.random() < .7:
+            k = rng.randrange(1, 40)
+            decoder.feed(bytes(stream[:k]))
+            del stream[:k]
+        if not stream:
+            assert same(decoder.tetris, t), tick
+        if not t.running:
+            break
+        t.act(agent.act(t))
+        t.update()
+    data = encoder.encode(tick+1, t)
+    if data is not None:
+        stream += data
+    decoder.feed(bytes(stream))
+    assert same(decoder.tetris, t)
+    assert t.lines > 0
+
+def test_actions():
+    actions = [Action(a) for a in range(64)]
+    assert list(decodeactions(b"".join(encodeaction(a) for a in actions))) == actions
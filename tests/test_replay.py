@@ -0,0 +1,40 @@
+import random
+
+from engine import *
+from replay import *
+import ai
+
+# Seeking a replay must land on exactly the state the live game had
+
+def state(t):
+    s = t.snapshot()
+    return (s[:3], s[3].tolist(), s[4:])
+
+def test_seek(tmp_path):
+    t = Tetris(20, 10, 11)
+    log = InputLog.start(t)
+    agent = ai.GreedyAgent()
+    agent.reset(t, 0)
+    rng = random.Random(3)
+    held = Action.NONE
+    states = {}
+    for tick in range(1, 12001):
+        if rng.random() < .3:
+            # Held moves and soft drops as a player would, not just the
+            # agent's taps
+            held = rng.choice([Action.NONE, Action.LEFT, Action.RIGHT, Action.SOFTDROP])
+        action = agent.act(t)
+        t.act(action if action != Action.FASTDROP else held)
+        t.update()
+        if tick % 487 == 0 or not t.running:
+            states[tick] = state(t)
+        if not t.running:
+            break
+
+    path = str(tmp_path / "seek.tlog")
+    log.save(path)
+    replayer = Replayer(InputLog.load(path), interval=256)
+    ticks = list(states)
+    rng.shuffle(ticks)
+    for tick in ticks:
+        assert state(replayer.seek(tick)) == states[tick], tick
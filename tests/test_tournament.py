@@ -0,0 +1,35 @@
+import json
+
+from tournament import *
+
+# A tournament resumed from a checkpoint cut short by a crash plays only
+# the missing games and ends up with the same standings
+
+def settings(path):
+    return dict(specs=["greedy", "random", "greedy:-1,0,0,0,0"], games=1, maxticks=600,
+            workers=1, checkpoint=path)
+
+def test_resume_truncated(tmp_path):
+    path = str(tmp_path / "run.jsonl")
+    full = Tournament(**settings(path)).run()
+    with open(path) as f:
+        lines = f.readlines()
+    assert len(lines) == 1 + 6
+
+    # Two games finished, the third was being written
+    with open(path, "w") as f:
+        f.writelines(lines[:3])
+        f.write(lines[3][:len(lines[3])//2])
+    played = []
+    resumed = Tournament(**settings(path))
+    assert len(resumed.checkpoint.done) == 2
+    assert resumed.run(lambda t, o: played.append(o)) == full
+    assert len(played) == 4
+
+    # Every line is whole again and a further resume plays nothing
+    with open(path) as f:
+        outcomes = [json.loads(line) for line in f.readlines()[1:]]
+    assert len(outcomes) == 6
+    played.clear()
+    assert Tournament(**settings(path)).run(lambda t, o: played.append(o)) == full
+    assert not played
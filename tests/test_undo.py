@@ -0,0 +1,59 @@
+import random
+
+from engine import *
+import ai
+
+# apply then undo must restore the game exactly, and replaying the same
+# placements must reach the same states again
+
+def state(t):
+    # Everything but the generator, whose queue may hold pieces drawn
+    # ahead, and the held controls
+    s = t.snapshot()
+    return (s[:3], s[3].tolist(), s[4:-2])
+
+def test_apply_undo():
+    t = Tetris(20, 10, 4)
+    rng = random.Random(1)
+    for it in range(300):
+        if not t.running:
+            break
+        before = state(t)
+        moves, states = ([], [])
+        for depth in range(rng.randrange(1, 4)):
+            ranked = ai.rankplacements(t)
+            if not t.running or not ranked:
+                break
+            moves.append(rng.choice(ranked[:5])[1])
+            t.apply(moves[-1])
+            states.append(state(t))
+        for m in moves:
+            t.undo()
+        assert state(t) == before, it
+        for m, s in zip(moves, states):
+            t.apply(m)
+            assert state(t) == s, it
+            assert t.hash == boardhash(t.bits), it
+        for m in moves:
+            t.undo()
+
+        ranked = ai.rankplacements(t)
+        if not ranked:
+            break
+        snapshot = t.snapshot()
+        t.apply(ranked[0][1])
+        after = state(t)
+        t.restore(snapshot)
+        t.apply(ranked[0][1])
+        assert state(t) == after, it
+    assert t.lines > 0
+
+def test_apply_publishes_only_when_asked():
+    t = Tetris(20, 10, 4)
+    locked = []
+    t.events.subscribe(PieceLocked, locked.append)
+    t.apply(ai.rankplacements(t)[0][1])
+    t.undo()
+    assert not locked
+    t.apply(ai.rankplacements(t)[0][1], publish=True)
+    assert len(locked) == 1
@@ -1,6 +1,10 @@
+import os
 import time
+import argparse
 import typing
 import random
+import asyncio
+import threading
 from abc import ABC, abstractmethod
 import pygame
 import numpy as np
@@ -9,274 +13,13 @@ from enum import Enum
 from PyEngine.States.GameState import *
 from PyEngine.States.Statestack import *
 
-from DesignPatterns.ObserverPattern.Observer import *
-
-##########################################################
-# This section contains the Tetris game
-# and logic itself. 
-# Including:
-# Tiles
-# Pieces
-# Tetris Logic
-##########################################################
-
-class Pieces(Enum):
-    IPiece = 0
-    JPiece = 1
-    SPiece = 2
-    ZPiece = 3
-    LPiece = 4
-    TPiece = 5
-    OPiece = 6
-
-class Tile():
-    def __init__(self, color: pygame.Color):
-        self.color = color
-
-class Piece(ABC):
-    @abstractmethod
-    def __init__(self):
-        # Abstract property
-        pass
-
-    @property
-    def color(self):
-        raise NotImplementedError
-    
-    @property
-    def matrix(self):
-        raise NotImplementedError
-
-    def rotateLeft(self):
-        return np.rot90(self.matrix)
-
-    def rotateRight(self):
-        return np.rot90(self.matrix,3)
-
-
-
-class IPiece(Piece):
-    color = pygame.Color(0,240,240)
-    matrix = np.array(
-            [
-            None,None,None,None,
-            Tile(color),Tile(color),Tile(color),Tile(color),
-            None,None,None,None,
-            None,None,None,None]).reshape((4,4))
-
-    def __init__(self):
-        pass
-
-class JPiece(Piece):
-    color = pygame.Color(0,0,240)
-    matrix = np.array(
-            [
-            None,None,Tile(color),None,
-            None,None,Tile(color),None,
-            None,Tile(color),Tile(color),None,
-            None,None,None,None]).reshape((4,4))
-
-    def __init__(self):
-        pass
-
-class LPiece(Piece):
-    color = pygame.Color(240,160,0)
-    matrix = np.array(
-            [
-            None,Tile(color),None,None,
-            None,Tile(color),None,None,
-            None,Tile(color),Tile(color),None,
-            None,None,None,None]).reshape((4,4))
-
-    def __init__(self):
-        pass
-
-class OPiece(Piece):
-    color = pygame.Color(240,240,0)
-    matrix = np.array(
-            [
-            None,None,None,None,
-            None,Tile(color),Tile(color),None,
-            None,Tile(color),Tile(color),None,
-            None,None,None,None]).reshape((4,4))
-
-    def __init__(self):
-        pass
-
-class SPiece(Piece):
-    color = pygame.Color(0,240,0)
-    matrix = np.array(
-            [
-            None,None,None,None,
-            None,None,Tile(color),Tile(color),
-            None,Tile(color),Tile(color),None,
-            None,None,None,None]).reshape((4,4))
-
-    def __init__(self):
-        pass
-
-class TPiece(Piece):
-    color = pygame.Color(160,0,240)
-    matrix = np.array(
-            [
-            None,None,None,None,
-            None,None,Tile(color),None,
-            None,Tile(color),Tile(color),Tile(color),
-            None,None,None,None]).reshape((4,4))
-
-    def __init__(self):
-        pass
-
-class ZPiece(Piece):
-    color = pygame.Color(240,0,0)
-    matrix = np.array(
-            [
-            None,None,None,None,
-            Tile(color),Tile(color),None,None,
-            None,Tile(color),Tile(color),None,
-            None,None,None,None]).reshape((4,4))
-
-    def __init__(self):
-        pass
-
-class PieceGenerator():
-    @staticmethod
-    def generate():
-        i = random.choice(list(Pieces)).value
-        if i is 0:
-            return IPiece()
-        elif i is 1:
-            return ZPiece()
-        elif i is 2:
-            return TPiece()
-        elif i is 3:
-            return LPiece()
-        elif i is 4:
-            return JPiece()
-        elif i is 5:
-            return OPiece()
-        elif i is 6:
-            return SPiece()
-
-class Tetris(Subject):
-    _observers = []
-    def __init__(self, rows, cols):
-        self.rows, self.cols = (rows,cols)
-        self.board = np.array([None]*self.rows*self.cols).reshape(self.rows,self.cols)  
-        self.cpiece = PieceGenerator.generate()
-        self.npiece = PieceGenerator.generate()
-
-        self.offset = (0,3)
-        self.score = 0
-        self.tickcap = 20
-        self.ticks = 0
-
-        self.running = True
-        self.busy = False
-
-        self.moveLeft = False
-        self.moveRight = False
-        self.moveDown = False
-        self.rotateRight = False
-        self.rotateLeft = False
-
-    def update(self):
-        self.ticks +=1
-        if(self.ticks % 3 == 0): self.domoves()
-        if(self.ticks % 1 == 0): self.dorotations()
-
-        if self.ticks < self.tickcap: return
-        self.ticks = 0
-        
-        if self.collisionx(1,self.cpiece.matrix) or self.collisionpiece((1,0),self.cpiece.matrix): 
-            self.recover()
-            self.clearlines()
-        else:
-            self.move((1,0))
-
-    def domoves(self):
-        if self.busy:
-            return
-        if self.moveLeft and not self.collisiony(-1,self.cpiece.matrix) and not self.collisionpiece((0,-1),self.cpiece.matrix):
-            self.move((0,-1))
-        if self.moveRight and not self.collisiony(1,self.cpiece.matrix) and not self.collisionpiece((0,1),self.cpiece.matrix):
-            self.move((0,1))
-    
-    def dorotations(self):
-        if self.busy:
-            return
-        if self.rotateLeft:
-            new = self.cpiece.rotateLeft()
-            if( not self.collisionx(0,new) 
-                and not self.collisiony(0,new)
-                and not self.collisionpiece((0,0),new)):
-                self.cpiece.matrix = new
-                self.rotateLeft = False
-        if self.rotateRight:
-            new = self.cpiece.rotateRight()
-            if( not self.collisionx(0,new) 
-                and not self.collisiony(0,new)
-                and not self.collisionpiece((0,0),new)):
-                self.cpiece.matrix = new
-                self.rotateRight = False
-
-
-    def recover(self):
-        self.blitpiecetoboard()
-        self.cpiece = self.npiece
-        self.npiece = PieceGenerator.generate()
-        self.offset = (0,3)
-        if self.collisionpiece((0,0),self.cpiece.matrix):
-            self.running = False
-
-    def move(self,pos):
-        self.offset = (self.offset[0]+pos[0],self.offset[1]+pos[1])
-
-    def blitpiecetoboard(self):
-        for i, arr in enumerate(self.cpiece.matrix):
-            for j, tile in enumerate(arr):
-                if tile: self.board[i+self.offset[0],j+self.offset[1]] = tile
-
-    def collisionx(self,x,matrix):
-        for i,arr in enumerate(matrix):
-            for j, tile in enumerate(arr):
-                if tile and (i+self.offset[0]+x > 19):
-                    return True
-        return False
-    
-    def collisiony(self, y,matrix):
-        for i, arr in enumerate(matrix):
-            for j, tile in enumerate(arr):
-                if tile and (0>j+self.offset[1]+y or j+self.offset[1]+y>9):
-                    return True
-        return False
-
-    def collisionpiece(self,pos,matrix):
-        for i, arr in enumerate(matrix):
-            for j, tile in enumerate(arr):
-                if tile and (self.board[i+self.offset[0]+pos[0],j+self.offset[1]+pos[1]]):
-                        return True
-        return False
-    
-    def clearlines(self):
-        for i, arr in enumerate(self.board):
-            if self.linefull(arr):
-                self.board = np.delete(self.board,[i],0)
-                self.board = np.insert(self.board,0,np.array([None]*self.cols),0)
-
-    def linefull(self, line):
-        for i in line:
-            if not i:
-                return False
-        return True
-
-    def prettyprint(self):
-        for i in self.board:
-            for j in i:
-                if j:
-                    print("T ",end="")
-                else: print("N ",end="")
-            print()
+from engine import *
+from server import *
+from replay import *
+from profiler import *
+from match import *
+import framebuffer
+import ai
 
 ####################################################
 # Static Renderer
@@ -288,14 +31,14 @@ class Renderer():
         for i,arr in enumerate(matrix):
             for j,tile in enumerate(arr):
                 if tile:
-                    pygame.draw.rect(screen, tile.color, ((j+offset[1])*size[1],(i+offset[0])*size[0],size[1]-1,size[0]-1))
+                    pygame.draw.rect(screen, PALETTE[tile], ((j+offset[1])*size[1],(i+offset[0])*size[0],size[1]-1,size[0]-1))
 
     def drawnext(screen, matrix, size, offset):
         for i, arr in enumerate(matrix):
             for j, tile in enumerate(arr):
                 pygame.draw.rect(
                         screen,
-                        (pygame.Color(60,60,60) if not tile else tile.color), 
+                        (pygame.Color(60,60,60) if not tile else PALETTE[tile]), 
                             ((j+offset[1])*size[1],(i+offset[0])*size[0],size[1]-1,size[0]-1)
                                 )
 
@@ -310,6 +53,7 @@ class GameType(Enum):
     sp = 1
     mp = 2
     server = 3
+    match = 4
 
 
 class IGameType:
@@ -337,14 +81,28 @@ class IGameType:
     def events(self, events):
         raise NotImplementedError
 
+    def drain(self):
+        # Once a frame, after the updates: delivers buffered events
+        pass
+
+    def leave(self):
+        # When its GameRunning state is left
+        pass
+
 
 class SinglePlayerGameType(IGameType):
     controller = None
     renderer = None
+    # Directory to save an input log of every game to, see replay.py
+    recorddir = None
     
     def __init__(self):
         self.rows, self.cols = (20,10)
         self.t = Tetris(self.rows, self.cols)
+        if self.recorddir is not None:
+            self.log = InputLog.start(self.t)
+            # Written on a worker thread so the game never waits for disk
+            self.t.events.subscribe(GameOver, self.savelog, Delivery.threaded)
 
         self.controller = SinglePlayerController()
         self.renderer = SinglePlayerRenderer(self.rows, self.cols)
@@ -355,37 +113,115 @@ class SinglePlayerGameType(IGameType):
     def update(self, dt):
         self.t.update()
 
+    def drain(self):
+        self.t.events.drain()
+
+    def savelog(self, event):
+        self.log.save(os.path.join(self.recorddir, "%d.tlog" % event.tetris.seed))
+        # The game is over, let the worker thread end after this
+        self.t.events.close(wait=False)
+
+    def leave(self):
+        self.t.events.close(wait=False)
+
     def render(self, screen):
-        self.renderer.render(screen, self.t)
+        return self.renderer.render(screen, self.t)
 
     def events(self, events):
         self.controller.GameInput(events,self.t)
 
-class TwoPlayerGameType(IGameType):
+class MatchGameType(IGameType):
+    # n boards in one Match: the first humans boards take the keyboard
+    # layouts in order, the others are played by agent(). A lone human gets
+    # the single player keys. Turbo with --turbo 0 plays it without drawing.
+    controller = None
+    renderer = None
+
+    def __init__(self, n=2, humans=2, agent=ai.GreedyAgent):
+        self.rows, self.cols = (20,10)
+        self.match = Match(n, self.rows, self.cols,
+                agents=[None]*humans + [agent() for i in range(n-humans)])
+
+        self.controller = MatchController((SOLOLAYOUT,) if humans == 1 else KEYLAYOUTS[:humans])
+        self.renderer = MatchRenderer(n, self.rows, self.cols)
+
+    def calcWindowSize(self):
+        return self.renderer.windowsize
+
+    def update(self,dt):
+        self.match.step()
+
+    def drain(self):
+        for tetris in self.match.games:
+            tetris.events.drain()
+
+    def render(self, screen):
+        return self.renderer.render(screen, self.match.games)
+
+    def events(self, events):
+        self.controller.GameInput(events, self.match.games)
+
+
+class ServerGameType(IGameType):
+    # Runs the GameServer on its own thread and shows one of its sessions.
+    # The server stops when the state is left.
     controller = None
     renderer = None
 
     def __init__(self):
         self.rows, self.cols = (20,10)
-        self.t1 = Tetris(self.rows, self.cols)
-        self.t2 = Tetris(self.rows, self.cols)
+        self.controller = SinglePlayerController()
+        self.server = GameServer(controller=self.controller, rows=self.rows, cols=self.cols)
+        # Set by the server thread when serving fails, e.g. the port is taken
+        self.error = None
+        self.thread = threading.Thread(target=self.serve, daemon=True)
+        self.thread.start()
+
+        self.renderer = SinglePlayerRenderer(self.rows, self.cols)
+        self.idle = Tetris(self.rows, self.cols)
+        self.watching = None
+        self.shown = None
 
-        self.controller = TwoPlayerController()
+    def serve(self):
+        try:
+            asyncio.run(self.server.serve())
+        except OSError as e:
+            self.error = e
 
-        self.renderer = TwoPlayerRenderer(self.rows, self.cols)
+    def leave(self):
+        self.server.stop()
+        self.thread.join(1)
 
     def calcWindowSize(self):
         return self.renderer.windowsize
 
-    def update(self,dt):
-        self.t1.update()
-        self.t2.update()
+    def update(self, dt):
+        pass
 
     def render(self, screen):
-        self.renderer.render(screen, [self.t1,self.t2])
+        if self.error is not None:
+            return self.showerror(screen)
+        sessions = list(self.server.sessions.values())
+        watching = self.watching if self.watching in sessions else (sessions[0] if sessions else None)
+        if watching is not self.watching:
+            self.watching = watching
+            self.renderer.view.invalidate()
+        return self.renderer.render(screen, watching.tetris if watching else self.idle)
+
+    def showerror(self, screen):
+        if self.shown is self.error:
+            return []
+        self.shown = self.error
+        print("server on port %d failed: %s" % (self.server.port, self.error))
+        screen.fill((60,60,60))
+        font = pygame.font.Font(None, 24)
+        lines = ["Server on port %d failed:" % self.server.port, str(self.error.strerror or self.error)]
+        for i, line in enumerate(lines):
+            screen.blit(font.render(line, True, (250,250,250)), (20, 20+30*i))
+        return None
 
     def events(self, events):
-        self.controller.GameInput(events,[self.t1, self.t2])
+        pass
 
 
 class GameTypeFactory:
@@ -394,9 +230,11 @@ class GameTypeFactory:
         if enu is GameType.sp:
             return SinglePlayerGameType()
         elif enu is GameType.mp:
-            return TwoPlayerGameType()
+            return MatchGameType(2, 2)
+        elif enu is GameType.match:
+            return MatchGameType(8, 1)
         elif enu is GameType.server:
-            return SinglePlayerGameType()
+            return ServerGameType()
         else:
             raise NotImplementedError
 
@@ -426,6 +264,10 @@ class MainMenu(GameState):
                     StateStack.push(GameRunning(GameType.sp))
                 elif event.key == pygame.K_m:
                     StateStack.push(GameRunning(GameType.mp))
+                elif event.key == pygame.K_s:
+                    StateStack.push(GameRunning(GameType.server))
+                elif event.key == pygame.K_t:
+                    StateStack.push(GameRunning(GameType.match))
 
 
 class GameRunning(GameState):
@@ -440,11 +282,17 @@ class GameRunning(GameState):
         self.gameType.update(dt)
 
     def render(self, screen):
-        self.gameType.render(screen)
+        return self.gameType.render(screen)
 
     def events(self,events):
         self.gameType.events(events)
 
+    def drain(self):
+        self.gameType.drain()
+
+    def leave(self):
+        self.gameType.leave()
+
     
 
 #####################################################
@@ -469,61 +317,121 @@ class SinglePlayerRenderer(IGameStateRenderer):
         self.rows, self.cols = (rows,cols)
         self.w, self.h = (300,600)
         self.sw, self.sh = (200,self.h)
-        self.surf1 = pygame.Surface((self.w,self.h))
-        self.surf2 = pygame.Surface((self.sw, self.sh))
+        self.view = BoardView(rows, cols, (0,0), (self.w,self.h), (self.w,0), (self.sw,self.sh))
         self.windowsize = (self.w+self.sw,self.h)
 
     def render(self, screen, tetris):
-        self.surf1.fill((180,180,180))
-        self.surf2.fill((60,60,60))
-        Renderer.drawtiles(self.surf1,tetris.cpiece.matrix,(self.w/self.cols, self.h/self.rows),tetris.offset)
-        Renderer.drawtiles(self.surf1,tetris.board,(self.w/self.cols, self.h/self.rows), (0,0))
-        Renderer.drawnext(self.surf2,tetris.npiece.matrix,(self.w/self.cols, self.h/self.rows),(1,1))
-
-        screen.blit(self.surf1,(0,0))
-        screen.blit(self.surf2,(self.w,0))
-
-class TwoPlayerRenderer(IGameStateRenderer):
-    def __init__(self, rows, cols):
+        return self.view.render(screen, tetris)
+
+class BoardView():
+    # Draws one Tetris straight onto the screen and returns the rects it
+    # changed. Locked tiles are cached on layer, and only rows that differ
+    # from what layer shows are redrawn. The falling piece is an overlay of
+    # pre-rendered tile sprites that is erased by copying layer back.
+    def __init__(self, rows, cols, origin, size, nextorigin, nextsize):
         self.rows, self.cols = (rows,cols)
-        self.w, self.h = (300,600)
-        self.sw, self.sh = (200,self.h) 
-
-        self.surf1p1 = pygame.Surface((self.w,self.h))
-        self.surf2p1 = pygame.Surface((self.sw, self.sh))
-
-        self.surf1p2 = pygame.Surface((self.w,self.h))
-        self.surf2p2 = pygame.Surface((self.sw, self.sh))
-
-        self.p1 = pygame.Surface((self.w+self.sw,self.h))
-        self.p2 = pygame.Surface((self.w+self.sw,self.h))
-
-        self.windowsize = (2*(self.w+self.sw),self.h)
+        self.origin, self.nextorigin = (origin, nextorigin)
+        self.tw, self.th = (size[0]//cols, size[1]//rows)
+        self.rect = pygame.Rect(origin, size)
+        self.nextrect = pygame.Rect(nextorigin, nextsize)
+
+        self.layer = pygame.Surface(size)
+        self.nextsurf = pygame.Surface(nextsize)
+        self.sprites = [None]
+        for color in PALETTE[1:]:
+            sprite = pygame.Surface((self.tw-1, self.th-1))
+            sprite.fill(color)
+            self.sprites.append(sprite)
+
+        self.shown = None
+        self.piecerect = None
+        self.nextpiece = None
+
+    def invalidate(self):
+        self.shown = None
 
     def render(self, screen, tetris):
-        self.surf1p1.fill((180,180,180))
-        self.surf2p1.fill((60,60,60))
-        self.surf1p2.fill((180,180,180))
-        self.surf2p2.fill((60,60,60))
-
-        Renderer.drawtiles(self.surf1p1,tetris[1].cpiece.matrix,(self.w/self.cols, self.h/self.rows),tetris[1].offset)
-        Renderer.drawtiles(self.surf1p1,tetris[1].board,(self.w/self.cols, self.h/self.rows), (0,0))
-        Renderer.drawnext(self.surf2p1,tetris[1].npiece.matrix,(self.w/self.cols, self.h/self.rows),(1,1))
-
-        Renderer.drawtiles(self.surf1p2,tetris[0].cpiece.matrix,(self.w/self.cols, self.h/self.rows),tetris[0].offset)
-        Renderer.drawtiles(self.surf1p2,tetris[0].board,(self.w/self.cols, self.h/self.rows), (0,0))
-        Renderer.drawnext(self.surf2p2,tetris[0].npiece.matrix,(self.w/self.cols, self.h/self.rows),(1,1))
-
-        self.p1.blit(self.surf1p1,(0,0))
-        self.p1.blit(self.surf2p1,(self.w,0))
-        self.p2.blit(self.surf1p2,(0,0))
-        self.p2.blit(self.surf2p2,(self.w,0))
-
-        screen.blit(self.p1,(0,0))
-        screen.blit(self.p2,(self.w+self.sw,0))
-
-
+        dirty = []
+        if self.shown is None:
+            self.layer.fill((180,180,180))
+            self.shown = np.zeros((self.rows,self.cols), dtype=np.uint8)
+            rows = range(self.rows)
+            self.piecerect = None
+            self.nextpiece = None
+            dirty.append(self.rect)
+            screen.blit(self.layer, self.origin)
+        else:
+            rows = np.nonzero((tetris.board != self.shown).any(1))[0]
+
+        for i in rows:
+            self.drawrow(tetris.board, i)
+            strip = pygame.Rect(0, i*self.th, self.rect.w, self.th)
+            screen.blit(self.layer, strip.move(self.origin), strip)
+            dirty.append(strip.move(self.origin))
+
+        # Erase the piece by restoring what the layer has underneath
+        if self.piecerect:
+            screen.blit(self.layer, self.piecerect, self.piecerect.move(-self.origin[0], -self.origin[1]))
+            dirty.append(self.piecerect)
+        self.piecerect = self.drawpiece(screen, tetris.cpiece.shape, tetris.offset)
+        dirty.append(self.piecerect)
+
+        if self.nextpiece != (tetris.npiece.type, tetris.npiece.rotation):
+            self.nextpiece = (tetris.npiece.type, tetris.npiece.rotation)
+            self.nextsurf.fill((60,60,60))
+            Renderer.drawnext(self.nextsurf, tetris.npiece.matrix, (self.th, self.tw), (1,1))
+            screen.blit(self.nextsurf, self.nextorigin)
+            dirty.append(self.nextrect)
+        return dirty
+
+    def drawrow(self, board, i):
+        self.layer.fill((180,180,180), (0, i*self.th, self.rect.w, self.th))
+        for j, tile in enumerate(board[i]):
+            if tile:
+                self.layer.blit(self.sprites[tile], (j*self.tw, i*self.th))
+        self.shown[i] = board[i]
+
+    def drawpiece(self, screen, shape, offset):
+        for i, j in zip(*shape.cells):
+            screen.blit(self.sprites[shape.value],
+                    (self.origin[0]+(offset[1]+j)*self.tw, self.origin[1]+(offset[0]+i)*self.th))
+        return pygame.Rect(self.origin[0]+(offset[1]+shape.left)*self.tw,
+                self.origin[1]+(offset[0]+shape.top)*self.th,
+                (shape.right-shape.left+1)*self.tw, (shape.bottom-shape.top+1)*self.th)
+
+class MatchRenderer(IGameStateRenderer):
+    # Every board and preview in one pass of framebuffer.frames, tiled
+    # into an atlas array the screen surface is a view of. Two boards keep
+    # the single player size, more shrink the tiles to fit MAXSIZE.
+    MAXSIZE = (1600,900)
+
+    def __init__(self, n, rows, cols):
+        self.n, self.rows, self.cols = (n,rows,cols)
+        for tile in range(30, 3, -1):
+            panel = tile*20//3
+            fw, fh = (cols*tile+panel, rows*tile)
+            across = min(n, max(1, self.MAXSIZE[0]//fw))
+            down = -(-n//across)
+            if down*fh <= self.MAXSIZE[1]:
+                break
+        self.tile, self.panel = ((tile,tile), panel)
+        self.across, self.down = (across, down)
+        self.windowsize = (across*fw, down*fh)
+
+        self.frames = np.zeros((across*down, fh, fw, 3), dtype=np.uint8)
+        self.atlas = np.zeros((down*fh, across*fw, 3), dtype=np.uint8)
+        self.grid = self.atlas.reshape(down, fh, across, fw, 3)
+        self.surface = pygame.image.frombuffer(self.atlas, self.windowsize, "RGB")
 
+    def render(self, screen, tetris):
+        framebuffer.frames(np.stack([t.board for t in tetris]),
+                [t.cpiece.type for t in tetris], [t.cpiece.rotation for t in tetris],
+                [t.offset[0] for t in tetris], [t.offset[1] for t in tetris],
+                [t.npiece.type for t in tetris], [t.npiece.rotation for t in tetris],
+                self.tile, self.panel, self.frames[:self.n])
+        self.grid[:] = self.frames.reshape(self.down, self.across, *self.frames.shape[1:]).swapaxes(1, 2)
+        screen.blit(self.surface, (0,0))
+        return [self.surface.get_rect()]
 
 #####################################################
 # This section contains 
@@ -569,57 +477,51 @@ class SinglePlayerController(IController):
                 if event.key == pygame.K_SPACE:
                     tetris.tickcap = 20
         
-    def ServerInput(self, events, tetris):
-        pass
+    def ServerInput(self, actions, tetris):
+        # Actions received from a client, see Iinput.decodeactions
+        for action in actions:
+            tetris.act(action)
+
+# Keys of every local player, by board. Moves are held, the rotations
+# latch, drop is a soft drop while held.
+KEYLAYOUTS = (
+        {pygame.K_a: "left", pygame.K_d: "right", pygame.K_s: "drop",
+            pygame.K_1: "rotateright", pygame.K_2: "rotateleft"},
+        {pygame.K_LEFT: "left", pygame.K_RIGHT: "right", pygame.K_DOWN: "drop",
+            pygame.K_PERIOD: "rotateright", pygame.K_COMMA: "rotateleft"})
+# Keys of SinglePlayerController, space drops fast while held
+SOLOLAYOUT = {pygame.K_LEFT: "left", pygame.K_RIGHT: "right", pygame.K_DOWN: "drop",
+        pygame.K_z: "rotateright", pygame.K_x: "rotateleft", pygame.K_SPACE: "fastdrop"}
+
+class MatchController(IController):
+    def __init__(self, layouts):
+        # key -> (board, role)
+        self.keys = {key: (i, role) for i, layout in enumerate(layouts) for key, role in layout.items()}
 
-class TwoPlayerController(IController):
     def GameInput(self,events,tetris):
         for event in events:
-            if event.type == pygame.KEYDOWN:
-                if event.key == pygame.K_LEFT:
-                    tetris[0].moveLeft = True
-                if event.key == pygame.K_RIGHT:
-                    tetris[0].moveRight = True
-                if event.key == pygame.K_DOWN:
-                    tetris[0].tickcap = 3
-                if event.key == pygame.K_PERIOD:
-                    tetris[0].rotateRight = True
-                if event.key == pygame.K_COMMA:
-                    tetris[0].rotateLeft = True
-
-                if event.key == pygame.K_a:
-                    tetris[1].moveLeft = True
-                if event.key == pygame.K_d:
-                    tetris[1].moveRight = True
-                if event.key == pygame.K_s:
-                    tetris[1].tickcap = 3
-                if event.key == pygame.K_1:
-                    tetris[1].rotateRight = True
-                if event.key == pygame.K_2:
-                    tetris[1].rotateLeft = True
-
-            if event.type == pygame.KEYUP:
-                if event.key == pygame.K_LEFT:
-                    tetris[0].moveLeft = False
-                if event.key == pygame.K_RIGHT:
-                    tetris[0].moveRight = False
-                if event.key == pygame.K_DOWN:
-                    tetris[0].tickcap = 20
-
-                if event.key == pygame.K_a:
-                    tetris[1].moveLeft = False
-                if event.key == pygame.K_d:
-                    tetris[1].moveRight = False
-                if event.key == pygame.K_s:
-                    tetris[1].tickcap = 20
-
-        
-    def ServerInput(self, events, tetris):
-        pass
-...
-...
-...
-
+            if event.type not in (pygame.KEYDOWN, pygame.KEYUP) or event.key not in self.keys:
+                continue
+            i, role = self.keys[event.key]
+            down = event.type == pygame.KEYDOWN
+            if role == "left":
+                tetris[i].moveLeft = down
+            elif role == "right":
+                tetris[i].moveRight = down
+            elif role == "drop":
+                tetris[i].tickcap = 3 if down else 20
+            elif role == "fastdrop":
+                tetris[i].tickcap = 1 if down else 20
+            elif role == "rotateright" and down:
+                tetris[i].rotateRight = True
+            elif role == "rotateleft" and down:
+                tetris[i].rotateLeft = True
+
+    def ServerInput(self, actions, tetris):
+        # One list of received actions per player
+        for player, received in zip(tetris, actions):
+            for action in received:
+                player.act(action)
 
 #####################################################
 # This section contains code for the communication
@@ -645,8 +547,56 @@ class TwoPlayerController(IController):
 # Game
 #####################################################
 
+class ProfilerOverlay():
+    # Rolling frame time percentiles in the top left corner, refreshed
+    # every few frames. What it covers is saved and put back before the
+    # next frame, so the states' dirty rects stay right underneath.
+    def __init__(self, profiler, every=30):
+        self.profiler = profiler
+        self.every = every
+        self.font = pygame.font.Font(None, 18)
+        self.text = None
+        self.rect = None
+        self.under = None
+
+    def erase(self, screen):
+        rect = self.rect
+        if rect:
+            screen.blit(self.under, rect)
+            self.rect = None
+        return rect
+
+    def draw(self, screen):
+        if self.text is None or self.profiler.frames % self.every == 0:
+            self.text = self.render()
+        self.rect = self.text.get_rect(topleft=(4,4)).clip(screen.get_rect())
+        self.under = screen.subsurface(self.rect).copy()
+        screen.blit(self.text, self.rect)
+        return self.rect
+
+    def render(self):
+        lines = ["%-8s %6s %6s %6s" % ("ms", "p50", "p95", "p99")]
+        for name, values in self.profiler.percentiles().items():
+            lines.append("%-8s %6.2f %6.2f %6.2f" % (name, *(v*1000 for v in values)))
+        texts = [self.font.render(line, True, (255,255,255)) for line in lines]
+        h = self.font.get_linesize()
+        surface = pygame.Surface((max(t.get_width() for t in texts)+8, len(texts)*h+8))
+        surface.fill((0,0,0))
+        for i, text in enumerate(texts):
+            surface.blit(text, (4, 4+i*h))
+        return surface
+
 class Game():
-    def __init__(self):
+    # Simulation runs at a fixed STEPRATE, independent of how fast frames
+    # render. When rendering falls behind, up to MAXSKIP steps run before
+    # the next frame and any further lag is dropped.
+    STEPRATE = 60
+    FRAMERATE = 60
+    MAXSKIP = 5
+    # Steps between event polls when turbo never renders
+    TURBOBATCH = 1000
+
+    def __init__(self, turbo=10, profile=0):
         ### pygame initializing
         pygame.init()
         self.w, self.h = (300,600)
@@ -654,6 +604,15 @@ class Game():
         self.screen = pygame.display.set_mode((self.w+self.sw,self.h))
         self.clock = pygame.time.Clock()
         self.running = True
+        self.exposed = True
+        # Turbo runs the simulation unthrottled and renders every
+        # self.turboevery steps, 0 renders nothing. Tab toggles it.
+        self.turbo = False
+        self.turboevery = turbo
+        # Per phase frame timings of the last profile frames, F2 shows
+        # them and F3 saves a Chrome trace
+        self.profiler = FrameProfiler(profile) if profile else NullProfiler()
+        self.overlay = None
 
         StateStack.push(MainMenu())
         self.CheckNewState()
@@ -662,23 +621,105 @@ class Game():
         for event in events:
             if event.type == pygame.QUIT:
                 self.running = False
+                StateStack.clear()
                 pygame.quit()
+            elif event.type == pygame.KEYDOWN and event.key == pygame.K_ESCAPE and len(StateStack.stack) > 1:
+                # Back to the menu
+                StateStack.pop()
+            elif event.type == pygame.VIDEOEXPOSE:
+                self.exposed = True
+            elif event.type == pygame.KEYDOWN and event.key == pygame.K_TAB:
+                self.turbo = not self.turbo
+                # The screen may be stale after turbo skipped frames
+                self.exposed = True
+            elif event.type == pygame.KEYDOWN and event.key == pygame.K_F2 and self.profiler.enabled:
+                if self.overlay:
+                    self.overlay.erase(self.screen)
+                    self.overlay = None
+                    self.exposed = True
+                else:
+                    self.overlay = ProfilerOverlay(self.profiler)
+            elif event.type == pygame.KEYDOWN and event.key == pygame.K_F3 and self.profiler.enabled:
+                print("trace saved to", self.profiler.dump(time.strftime("profile-%Y%m%d-%H%M%S.json")))
  
     def run(self):
+        steptime = 1/self.STEPRATE
+        lag = 0.0
+        previous = time.perf_counter()
+        profiler = self.profiler
         while self.running:
-            self.clock.tick(60)
+            profiler.start()
             events = pygame.event.get()
             self.events(events)
+            if not self.running:
+                break
             StateStack.events(events)
+            profiler.mark(EVENTS)
+
+            if self.turbo:
+                if self.turboevery:
+                    self.steps(self.turboevery)
+                    self.render()
+                else:
+                    self.steps(self.TURBOBATCH)
+                    profiler.mark(RENDER)
+                    profiler.mark(DISPLAY)
+                profiler.mark(WAIT)
+                lag = 0.0
+                previous = time.perf_counter()
+                continue
+
+            now = time.perf_counter()
+            lag += now-previous
+            previous = now
+            steps = min(int(lag/steptime), self.MAXSKIP)
+            self.steps(steps)
+            lag = 0.0 if steps == self.MAXSKIP else lag-steps*steptime
+            self.render()
+            self.clock.tick(self.FRAMERATE)
+            profiler.mark(WAIT)
+
+    def steps(self, n):
+        for i in range(n):
             StateStack.update(1)
-            StateStack.render(self.screen)
-            self.CheckNewState()
+        StateStack.drain()
+        self.profiler.mark(UPDATE)
+
+    def render(self):
+        # A new state gets its window before its first, full render
+        self.CheckNewState()
+        erased = self.overlay.erase(self.screen) if self.overlay else None
+        dirty = StateStack.render(self.screen)
+        if self.overlay:
+            drawn = self.overlay.draw(self.screen)
+            if dirty is not None:
+                dirty = dirty + [erased, drawn] if erased else dirty + [drawn]
+        self.profiler.mark(RENDER)
+        # States return the rects they changed or None for everything.
+        # display.update(None) updates nothing, a full update takes no
+        # arguments.
+        if self.exposed or dirty is None:
             pygame.display.update()
+        else:
+            pygame.display.update(dirty)
+        self.exposed = False
+        self.profiler.mark(DISPLAY)
     
     def CheckNewState(self):
         if StateStack.readstate():
             pygame.display.set_mode(StateStack.windowsize())
+            self.exposed = True
+
 
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--record", metavar="DIR", help="save an input log of every single player game")
+    parser.add_argument("--turbo", metavar="N", type=int, default=10,
+            help="steps per rendered frame in turbo mode (tab), 0 renders nothing")
+    parser.add_argument("--profile", metavar="FRAMES", type=int, default=0,
+            help="time the phases of the last FRAMES frames, F2 shows them, F3 saves a trace")
+    args = parser.parse_args()
+    SinglePlayerGameType.recorddir = args.record
 
-g = Game()
-g.run()
+    g = Game(args.turbo, args.profile)
+    g.run()
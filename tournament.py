@@ -0,0 +1,288 @@
+import os
+import sys
+import json
+import math
+import time
+import typing
+import argparse
+import multiprocessing
+import numpy as np
+
+from engine import *
+from match import *
+import ai
+
+##########################################################
+# Tournaments
+# Agents play two board matches, as in a local versus
+# game. Every pairing plays each seed twice with the
+# boards swapped, and all pairings of a round share the
+# same seeds. Games are spread over a process pool,
+# longest expected first, one at a time, so slow agents
+# do not leave workers idle at the end of a round.
+# Every finished game is appended to a checkpoint file,
+# and a rerun with the same file only plays the games
+# it is missing. Ratings are Bradley-Terry maximum
+# likelihood on the Elo scale, so they do not depend on
+# the order games finished in.
+#
+# python tournament.py greedy random "greedy:w1,w2,..."
+#        [--format swiss --rounds 5] [--games 4]
+#        [--checkpoint run.jsonl]
+##########################################################
+
+class Pairing(typing.NamedTuple):
+    round: int
+    # Entrant indices, a plays board 0
+    a: int
+    b: int
+    seed: int
+
+class Outcome(typing.NamedTuple):
+    round: int
+    a: int
+    b: int
+    seed: int
+    # Points for a: 1 win, 0.5 draw, 0 loss
+    points: float
+    scores: list
+    lines: list
+    ticks: int
+    walltime: float
+
+def makeagent(spec):
+    # "name" or "name:w1,w2,..." with heuristic weights, see ai.WEIGHTS
+    name, _, weights = spec.partition(":")
+    if weights:
+        return ai.AGENTS[name](weights=np.array([float(w) for w in weights.split(",")]))
+    return ai.AGENTS[name]()
+
+def playpairing(pairing, specs, maxticks):
+    start = time.perf_counter()
+    match = Match(2, seed=pairing.seed, agents=[makeagent(specs[pairing.a]), makeagent(specs[pairing.b])])
+    result = match.play(maxticks)
+    # Topping out loses, otherwise the higher score wins
+    alive = [t.running for t in match.games]
+    if alive[0] != alive[1]:
+        points = 1.0 if alive[0] else 0.0
+    else:
+        points = 0.5 + 0.5*np.sign(result.scores[0]-result.scores[1])
+    return Outcome(*pairing, float(points), result.scores, result.lines, result.ticks,
+            time.perf_counter()-start)
+
+def _playpairing(job):
+    return playpairing(*job)
+
+##########################################################
+# Pairings
+##########################################################
+
+def mirrored(round, a, b, seeds):
+    return [Pairing(round, x, y, seed) for seed in seeds for x, y in ((a, b), (b, a))]
+
+def roundseeds(seed, round, games):
+    return range(seed + round*games, seed + (round+1)*games)
+
+def roundrobin(n, games, seed):
+    seeds = roundseeds(seed, 0, games)
+    return [p for a in range(n) for b in range(a+1, n) for p in mirrored(0, a, b, seeds)]
+
+def swiss(n, round, games, seed, points, met):
+    # Pairs entrants top down by points with the best one they have not
+    # met yet. Returns the pairings and the entrant with a bye, if any.
+    order = sorted(range(n), key=lambda i: (-points[i], i))
+    bye = None
+    if n % 2:
+        # Lowest placed entrant without a bye so far
+        bye = next((i for i in reversed(order) if (i, None) not in met), order[-1])
+        order.remove(bye)
+    seeds = roundseeds(seed, round, games)
+    pairings = []
+    while order:
+        a = order.pop(0)
+        b = next((j for j in order if (min(a, j), max(a, j)) not in met), order[0])
+        order.remove(b)
+        pairings += mirrored(round, a, b, seeds)
+    return pairings, bye
+
+##########################################################
+# Ratings
+##########################################################
+
+def ratings(n, outcomes, iterations=500):
+    # Bradley-Terry strengths fitted by minorization-maximization, with a
+    # virtual draw per pair that met so unbeaten entrants stay finite
+    wins = np.zeros((n, n))
+    for o in outcomes:
+        wins[o.a, o.b] += o.points
+        wins[o.b, o.a] += 1-o.points
+    met = (wins + wins.T) > 0
+    wins += 0.5*met
+    games = wins + wins.T
+    played = games.sum(1) > 0
+    strength = np.ones(n)
+    for i in range(iterations):
+        denominator = (games / (strength[:, None] + strength[None, :])).sum(1)
+        strength = np.where(played, wins.sum(1) / np.maximum(denominator, 1e-12), 1.0)
+        strength /= np.exp(np.log(strength[played]).mean()) if played.any() else 1.0
+    return 1500 + 400*np.log10(strength)
+
+def records(n, outcomes):
+    # Wins, draws and losses per entrant
+    table = np.zeros((n, 3), dtype=int)
+    for o in outcomes:
+        k = int(2 - 2*o.points)
+        table[o.a, k] += 1
+        table[o.b, 2-k] += 1
+    return table
+
+##########################################################
+# Running
+##########################################################
+
+class Checkpoint():
+    # JSON lines: a header with the settings, then one Outcome per game
+    def __init__(self, path, settings):
+        self.path = path
+        self.done = {}
+        if path and os.path.exists(path) and os.path.getsize(path):
+            with open(path, "rb") as f:
+                data = f.read()
+            lines = data.splitlines()
+            header = json.loads(lines[0])
+            if header != settings:
+                raise ValueError("%s was written by a tournament with other settings" % path)
+            for line in lines[1:]:
+                try:
+                    outcome = Outcome(**json.loads(line))
+                except (ValueError, TypeError):
+                    # A line cut short by a crash
+                    continue
+                self.done[Pairing(*outcome[:4])] = outcome
+            # Drop a last line cut short, new lines must not be appended onto it
+            self.file = open(path, "r+")
+            self.file.truncate(data.rfind(b"\n")+1)
+            self.file.seek(0, os.SEEK_END)
+        elif path:
+            self.file = open(path, "w")
+            self.file.write(json.dumps(settings) + "\n")
+            self.file.flush()
+        else:
+            self.file = None
+
+    def add(self, outcome):
+        self.done[Pairing(*outcome[:4])] = outcome
+        if self.file:
+            self.file.write(json.dumps(outcome._asdict()) + "\n")
+            self.file.flush()
+
+    def close(self):
+        if self.file:
+            self.file.close()
+
+class Tournament():
+    def __init__(self, specs, format="roundrobin", rounds=None, games=2, seed=0, maxticks=20000,
+            workers=None, checkpoint=None):
+        self.specs = list(specs)
+        self.n = len(self.specs)
+        self.format = format
+        self.rounds = 1 if format == "roundrobin" else (rounds or math.ceil(math.log2(max(self.n, 2))))
+        self.games, self.seed, self.maxticks = (games, seed, maxticks)
+        self.workers = workers
+        self.checkpoint = Checkpoint(checkpoint, {"entrants": self.specs, "format": format,
+                "rounds": self.rounds, "games": games, "seed": seed, "maxticks": maxticks})
+        self.outcomes = []
+        # Swiss standings: points, and pairs that met with (i, None) for byes
+        self.points = [0.0]*self.n
+        self.met = set()
+        # Mean walltime of each entrant's games, for ordering the queue
+        self.walltime = [[] for i in range(self.n)]
+
+    def cost(self, pairing):
+        known = [t for times in self.walltime for t in times]
+        default = sum(known)/len(known) if known else 1.0
+        return sum(sum(times)/len(times) if times else default
+                for times in (self.walltime[pairing.a], self.walltime[pairing.b]))
+
+    def record(self, outcome):
+        self.outcomes.append(outcome)
+        self.points[outcome.a] += outcome.points
+        self.points[outcome.b] += 1-outcome.points
+        self.walltime[outcome.a].append(outcome.walltime)
+        self.walltime[outcome.b].append(outcome.walltime)
+
+    def run(self, progress=None):
+        pool = multiprocessing.Pool(self.workers) if self.workers != 1 else None
+        try:
+            for round in range(self.rounds):
+                if self.format == "roundrobin":
+                    pairings, bye = (roundrobin(self.n, self.games, self.seed), None)
+                else:
+                    pairings, bye = swiss(self.n, round, self.games, self.seed, self.points, self.met)
+                if bye is not None:
+                    self.points[bye] += 2*self.games
+                    self.met.add((bye, None))
+                for p in pairings:
+                    self.met.add((min(p.a, p.b), max(p.a, p.b)))
+
+                todo = []
+                for p in pairings:
+                    if p in self.checkpoint.done:
+                        self.record(self.checkpoint.done[p])
+                    else:
+                        todo.append(p)
+                todo.sort(key=self.cost, reverse=True)
+                jobs = [(p, self.specs, self.maxticks) for p in todo]
+                results = pool.imap_unordered(_playpairing, jobs) if pool else map(_playpairing, jobs)
+                for outcome in results:
+                    self.checkpoint.add(outcome)
+                    self.record(outcome)
+                    if progress:
+                        progress(self, outcome)
+        finally:
+            if pool:
+                pool.close()
+                pool.join()
+            self.checkpoint.close()
+        return self.standings()
+
+    def standings(self):
+        # (entrant, rating, wins, draws, losses) best first
+        elo = ratings(self.n, self.outcomes)
+        table = records(self.n, self.outcomes)
+        order = np.argsort(-elo, kind="stable")
+        return [(self.specs[i], float(elo[i]), *map(int, table[i])) for i in order]
+
+##########################################################
+# Command line
+##########################################################
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Rate agents in headless versus matches")
+    parser.add_argument("entrants", nargs="+", help="agent names, optionally name:w1,w2,... for weights")
+    parser.add_argument("--format", choices=("roundrobin", "swiss"), default="roundrobin")
+    parser.add_argument("--rounds", type=int, default=None, help="swiss rounds, default log2 of the entrants")
+    parser.add_argument("--games", type=int, default=2, help="seeds per pairing, each played both ways")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--maxticks", type=int, default=20000, help="then the higher score wins")
+    parser.add_argument("--workers", type=int, default=None, help="default: one per core")
+    parser.add_argument("--checkpoint", help="JSON lines file to resume from and append to")
+    parser.add_argument("--out", help="save the standings as JSON")
+    args = parser.parse_args(argv)
+
+    def progress(tournament, outcome):
+        print("round %d  %s vs %s  seed %d: %g" % (outcome.round, tournament.specs[outcome.a],
+                tournament.specs[outcome.b], outcome.seed, outcome.points), file=sys.stderr)
+
+    tournament = Tournament(args.entrants, args.format, args.rounds, args.games, args.seed,
+            args.maxticks, args.workers, args.checkpoint)
+    standings = tournament.run(progress)
+    print("%-4s %-40s %7s %5s %5s %5s" % ("", "entrant", "elo", "won", "drawn", "lost"))
+    for place, (spec, elo, won, drawn, lost) in enumerate(standings, 1):
+        print("%-4d %-40s %7.0f %5d %5d %5d" % (place, spec, elo, won, drawn, lost))
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump([dict(zip(("entrant", "elo", "won", "drawn", "lost"), row)) for row in standings], f, indent=1)
+
+if __name__ == "__main__":
+    main()